@@ -1,14 +1,19 @@
 import argparse
 import configparser
 import os
+import sys
 
-from baroque.baroque_project import BaroqueProject
-from baroque.checksum_validation import ChecksumValidator
-from baroque.file_format_validation import FileFormatValidator
-from baroque.mets_validation import MetsValidator
-from baroque.report_generation import generate_reports
-from baroque.structure_validation import StructureValidator
-from baroque.wav_bext_chunk_validation import WavBextChunkValidator
+# The BaroqueProject and each validator are imported only once they are needed, after the arguments have been parsed,
+# so that "--help" and runs that only select some validations do not pay for importing lxml, dateparser or openpyxl.
+
+
+def positive_int(value):
+    """
+    argparse type for options that need at least one worker or reader"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("{} is not a positive integer".format(value))
+    return number
 
 
 def main():
@@ -18,38 +23,75 @@ def main():
     parser.add_argument("-s", "--structure", action="store_true", help="Validate directory and file structure")
     parser.add_argument("-e", "--export", help="Path to metadata export")
     parser.add_argument("-m", "--mets", action="store_true", help="Validate METS")
+    parser.add_argument("--stream-mets", action="store_true", help="Stream METS instead of parsing it into a full tree, to validate very large METS files in constant memory")
     parser.add_argument("-w", "--wav", action="store_true", help="Validate WAV BEXT chunks")
     parser.add_argument("-f", "--files", action="store_true", help="Validate file formats")
     parser.add_argument("-c", "--checksums", action="store_true", help="Validate checksums")
+    parser.add_argument("-j", "--jobs", type=positive_int, default=1, help="Number of worker processes to spread files across")
+    parser.add_argument("-p", "--pipeline", action="store_true", help="Run METS, WAV BEXT chunk and checksum validations together in a single pass over the items")
+    parser.add_argument("-r", "--readers", type=positive_int, help="Maximum number of files to read at once when validating checksums (defaults to --jobs)")
+    parser.add_argument("-i", "--incremental", action="store_true", help="Only validate items that changed since the last run, reusing the errors found for the rest")
+    parser.add_argument("--report-format", choices=["csv", "parquet", "arrow"], default="csv", help="Format of the error report: csv (default), parquet or arrow (Parquet and Arrow require pyarrow)")
+    parser.add_argument("--summary-only", action="store_true", help="Only print the number of errors found by each validation, without writing an error report")
+    parser.add_argument("--no-cache", action="store_true", help="Parse the metadata export and hash every file, even if they are unchanged since the last run")
     args = parser.parse_args()
+    from baroque.baroque_project import BaroqueProject
+    from baroque.report_generation import ArrowErrorSink, CsvErrorSink, ParquetErrorSink, SummaryErrorSink, generate_reports
+
+    # Checked before the project is built, as building it can already write warnings to the error report
+    if (args.structure or args.mets or args.wav) and not args.export:
+        print("SYSTEM ERROR: metadata export [-e] is required for directory and file structure, METS validation and WAV BEXT chunks validations")
+        sys.exit()
+
+    # Errors are written to the error report as they are found, rather than kept in memory until the end of the run
+    if args.summary_only:
+        error_sink = SummaryErrorSink
+    else:
+        error_sink = {"csv": CsvErrorSink, "parquet": ParquetErrorSink, "arrow": ArrowErrorSink}[args.report_format]
+    # Runs that only print a summary reuse the errors cached by incremental runs, but do not record their own
+    project_options = {"use_cache": not args.no_cache, "incremental": args.incremental, "read_only_manifest": args.summary_only, "error_sink": error_sink}
 
     if args.destination:
-        project = BaroqueProject(args.source, args.destination, args.export)
+        project = BaroqueProject(args.source, args.destination, args.export, **project_options)
     else:
         try:
             config = configparser.ConfigParser()
             config.read("config.ini")
-            project = BaroqueProject(args.source, config["reports"]["path"], args.export)
+            project = BaroqueProject(args.source, config["reports"]["path"], args.export, **project_options)
         except:
             if not os.path.isdir("reports"):
                 os.mkdir("reports")
-            project = BaroqueProject(args.source, "reports", args.export)
-        
-    if (args.structure or args.mets or args.wav) and not args.export:
-        print("SYSTEM ERROR: metadata export [-e] is required for directory and file structure, METS validation and WAV BEXT chunks validations")
-        sys.exit()
+            project = BaroqueProject(args.source, "reports", args.export, **project_options)
 
+    validators = []
     if args.structure:
-        StructureValidator(project).validate()
+        from baroque.structure_validation import StructureValidator
+        validators.append(StructureValidator(project))
     if args.mets:
-        MetsValidator(project).validate()
+        from baroque.mets_validation import MetsValidator
+        validators.append(MetsValidator(project, jobs=args.jobs, streaming=args.stream_mets))
     if args.wav:
-        WavBextChunkValidator(project).validate()
+        from baroque.wav_bext_chunk_validation import WavBextChunkValidator
+        validators.append(WavBextChunkValidator(project, jobs=args.jobs))
     if args.files:
-        FileFormatValidator(project).validate()
+        from baroque.file_format_validation import FileFormatValidator
+        validators.append(FileFormatValidator(project))
     if args.checksums:
-        ChecksumValidator(project).validate()
+        from baroque.checksum_validation import ChecksumValidator
+        validators.append(ChecksumValidator(project, jobs=args.jobs, readers=args.readers, use_cache=not args.no_cache))
+
+    pipelined_validators = []
+    for validator in validators:
+        if args.pipeline and validator.item_validator:
+            pipelined_validators.append(validator)
+        else:
+            validator.validate()
+    if pipelined_validators:
+        from baroque.pipeline import ValidationPipeline
+        ValidationPipeline(pipelined_validators, jobs=args.jobs).validate()
 
+    if project.manifest:
+        project.manifest.save()
     generate_reports(project)
 
 
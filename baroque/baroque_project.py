@@ -1,9 +1,52 @@
 import csv
 import os
+import pickle
+import re
 import sys
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 
-from openpyxl import load_workbook
+from .report_generation import MemoryErrorSink
+from .run_manifest import RunManifest
+from .utils import md5_checksum
+
+
+# Bump whenever the structure returned by "parse_metadata_export" changes, so that stale snapshots are not loaded.
+METADATA_SNAPSHOT_VERSION = 2
+
+# The file formats that make up a digital part (e.g., 85429-SR-1-1-am.wav, 85429-SR-1-1-am.wav.md5, ...)
+# New derivative types only need to be added to PART_FILE_FORMATS.
+PART_FILE_TYPES = ["md5", "mp3", "wav"]
+PART_FILE_FORMATS = ["-am.wav", "-am.wav.md5", "-pm.wav", "-pm.wav.md5", ".mp3", ".mp3.md5"]
+# Matches a part file name in a single pass, capturing its part id (e.g., 85429-SR-1-1) and the format it ends with, if any.
+# The lazy ".*?" makes the format group match at the earliest position it can reach the end of the name from.
+part_file_regex = re.compile(
+    r"(\d+\-SR-\d+(?:\-\d+)+).*?(" + "|".join(re.escape(format) for format in PART_FILE_FORMATS) + r")?\Z",
+    re.DOTALL
+)
+part_format_indexes = {format: index for index, format in enumerate(PART_FILE_FORMATS)}
+
+
+class DigitalPart(NamedTuple):
+    """
+    The files of one digital part, as grouped by BaroqueProject.get_intellectual_groups.
+    """
+    # Part files (e.g., 85429-SR-1-1-am.wav)
+    files: list
+    # Number of part files with each format in PART_FILE_FORMATS (e.g., [1, 1, 1, 1, 1, 1])
+    counts: list
+    # Part files that have none of the formats in PART_FILE_FORMATS
+    other: list
+
+
+class ItemMetadata(NamedTuple):
+    """
+    An item's row in the metadata export, as indexed by BaroqueProject.parse_metadata_export. Missing values are None.
+    """
+    collection_title: str
+    item_title: str
+    item_date: str
 
 
 class BaroqueProject(object):
@@ -17,6 +60,8 @@ class BaroqueProject(object):
     It characterizes the source directory level by analyzing what is inside the source directory.
     Then, it parses the source directory recursively down to the item-level.
 
+    The "collections" and "items" dictionaries are also indexed by id in the "collections_by_id" and "items_by_id" attributes.
+
     An initial instantiation of this object might look like:
     {
         "source": source_directory,
@@ -32,12 +77,14 @@ class BaroqueProject(object):
             {
             "id": "",
             "path": "",
+            "num_entries": 0,
             }
         ],
         "items": [
             {
             "id": "",
             "path": "",
+            "num_entries": 0,
             "files": {
                 "wav": [],
                 "mp3": [],
@@ -47,12 +94,29 @@ class BaroqueProject(object):
                 "txt": [],
                 "other": []
                 },
+            "file_records": {
+                file name: {"size": 0, "mtime_ns": 0, "inode": 0, "format": "wav", "is_dir": False}
+                },
             }
         ],
     }
+
+    Each directory is scanned once with os.scandir, and the stat data of every entry in an item directory is kept in "file_records".
+    Validators read file sizes and signatures from "file_records" rather than going back to the file system.
+    Collection and item directories are scanned concurrently by up to crawl_threads threads,
+    since each scan is a round trip to the file system that mostly waits on network storage.
+    The order of collections and items is the same as when they are scanned one at a time.
+
+    The parsed metadata export is cached as a pickled snapshot in the destination directory (see "load_metadata_export"),
+    unless use_cache is False.
+
+    When incremental is True, the "manifest" attribute records the signature of every item and the errors found for it
+    (see baroque/run_manifest.py), and per-item validations skip items that are unchanged since the last run and reuse their cached errors.
+    When read_only_manifest is also True, the cached errors are reused but the errors found in this run are not recorded.
+    Otherwise, "manifest" is None.
     """
 
-    def __init__(self, source_directory, destination_directory, metadata_export=None):
+    def __init__(self, source_directory, destination_directory, metadata_export=None, crawl_threads=16, use_cache=True, incremental=False, read_only_manifest=False, error_sink=MemoryErrorSink):
         if not os.path.exists(source_directory):
             print("SYSTEM ERROR: source_directory does not exist")
             sys.exit()
@@ -63,14 +127,24 @@ class BaroqueProject(object):
         self.source_directory = source_directory
         self.destination_directory = destination_directory
         self.metadata_export = metadata_export
-        self.errors = {}
+        self.crawl_threads = crawl_threads
+        self.use_cache = use_cache
+        self.error_sink = error_sink(source_directory, destination_directory)
+        self.manifest = None
 
         if self.metadata_export:
-            self.metadata = self.parse_metadata_export(metadata_export)
+            self.metadata = self.load_metadata_export(metadata_export)
 
         self.shipment = []
         self.collections = []
         self.items = []
+        # Indexes of the "collections" and "items" dictionaries by id, for O(1) lookups by validators
+        self.collections_by_id = {}
+        self.items_by_id = {}
+        # Absolute path of each item directory -> item id, for attributing errors to items (see "get_item_id")
+        self.item_ids_by_path = {}
+        # Computed on first use by "get_intellectual_groups"
+        self.intellectual_groups = None
 
         self.source_type = self.characterize_source_directory()
         print("SYSTEM REPORT: source_directory is {}".format(self.source_type))
@@ -81,6 +155,10 @@ class BaroqueProject(object):
         elif self.source_type == "item":
             self.parse_item(source_directory)
 
+        if incremental:
+            item_metadata = self.metadata["item_metadata"] if self.metadata_export else None
+            self.manifest = RunManifest(self.destination_directory, self.items, item_metadata, use_cache, read_only_manifest)
+
     def characterize_source_directory(self):
         """
         Characterize the source directory level by analyzing what is inside the source directory.
@@ -122,39 +200,106 @@ class BaroqueProject(object):
         Take a shipment-level directory path, parse its id and directory path,
         and add a dictionary to the "shipment" attribute.
         Then, loop the shipment-level directory for collection-level directories,
-        and run "parse_collection" method on each collection-level directory.
+        and run "parse_collections" on the collection-level directories.
         """
         self.shipment.append({
             "id": os.path.basename(shipment_directory),
             "path": shipment_directory
         })
 
+        collection_directories = []
         for dir_entry in os.scandir(shipment_directory):
             if dir_entry.is_dir():
-                self.parse_collection(dir_entry.path)
+                collection_directories.append(dir_entry.path)
+
+        self.parse_collections(collection_directories)
 
     def parse_collection(self, collection_directory):
+        """
+        Take a collection-level directory path and run "parse_collections" on it.
+        """
+        self.parse_collections([collection_directory])
+
+    def parse_item(self, item_directory):
+        """
+        Take a item-level directory path and run "parse_items" on it.
+        """
+        self.parse_items([item_directory])
+
+    def parse_collections(self, collection_directories):
+        """
+        Take a list of collection-level directory paths, scan them concurrently with "scan_collection",
+        and add a dictionary for each to the "collections" attribute, in the same order as the list.
+        Then, run "parse_items" on all of their item-level directories.
+        """
+        with ThreadPoolExecutor(max_workers=self.crawl_threads) as executor:
+            collections = list(executor.map(self.scan_collection, collection_directories))
+
+        item_directories = []
+        for collection, collection_item_directories in collections:
+            self.collections.append(collection)
+            self.collections_by_id[collection["id"]] = collection
+            item_directories.extend(collection_item_directories)
+
+        self.parse_items(item_directories)
+
+    def parse_items(self, item_directories):
+        """
+        Take a list of item-level directory paths, scan them concurrently with "scan_item",
+        and add a dictionary for each item to the "items" attribute, in the same order as the list.
+        """
+        with ThreadPoolExecutor(max_workers=self.crawl_threads) as executor:
+            scanned_items = executor.map(self.scan_item, item_directories)
+
+            for item_directory, (files, file_records, nested_file_sizes, unreadable_files) in zip(item_directories, scanned_items):
+                for file_path, message in unreadable_files:
+                    self.add_errors("baroque_project", "warning", file_path, os.path.basename(item_directory), "file could not be read: {}".format(message))
+                if len(files["wav"]) > 0 or len(files["mp3"]) > 0:
+                    item = {
+                        "id": os.path.basename(item_directory),
+                        "path": item_directory,
+                        "num_entries": len(file_records),
+                        "files": files,
+                        "file_records": file_records,
+                        "nested_file_sizes": nested_file_sizes
+                    }
+                    self.items.append(item)
+                    self.items_by_id[item["id"]] = item
+                    self.item_ids_by_path[os.path.abspath(item_directory)] = item["id"]
+                else:
+                    self.add_errors("baroque_project", "warning", item_directory, os.path.basename(item_directory), "item directory does not appear to be an audio recording")
+
+    def scan_collection(self, collection_directory):
         """
         Take a collection-level directory path, parse its id and directory path,
-        and add a dictionary to the "collections" attribute.
-        Then, loop the directory for collection-level directories,
-        and run "parse_item" method on each item-level directory.
+        and return a collection dictionary along with the paths of its item-level directories.
         """
-        self.collections.append({
+        collection = {
             "id": os.path.basename(collection_directory),
-            "path": collection_directory
-        })
+            "path": collection_directory,
+            "num_entries": 0
+        }
+        item_directories = []
 
         for dir_entry in os.scandir(collection_directory):
+            collection["num_entries"] += 1
             if dir_entry.is_dir():
-                self.parse_item(dir_entry.path)
+                item_directories.append(dir_entry.path)
 
-    def parse_item(self, item_directory):
+        return collection, item_directories
+
+    def scan_item(self, item_directory):
         """
-        Take a item-level directory path, parse id, directory path, files by their file formats,
-        and add a dictionary to the "items" attribute.
+        Take a item-level directory path and return its files by their file formats,
+        along with the size, modification time and inode of every file recorded from the same os.scandir pass,
+        and the size of every file nested in its subdirectories, by path, in the order os.walk finds them.
+        Files that cannot be read, such as broken symbolic links, are recorded with a size of 0
+        (or left out of the nested file sizes) and returned as a list of (path, error message) pairs, so the scan carries on.
         """
         files = {"wav": [], "mp3": [], "jpg": [], "xml": [], "md5": [], "txt": [], "other": []}
+        file_records = {}
+        subdirectories = []
+        unreadable_files = []
         file_formats = {
             "wav": ["wav", "wave"],
             "mp3": ["mp3"],
@@ -164,89 +309,179 @@ class BaroqueProject(object):
             "txt": ["txt"]
         }
 
-        for file in os.listdir(item_directory):
-            other = True
+        for dir_entry in os.scandir(item_directory):
+            file = dir_entry.name
+            file_format = "other"
             extension = file.lower().split(".")[-1]
 
             for format, extensions in file_formats.items():
                 if extension in extensions:
-                    files[format].append(file)
-                    other = False
+                    file_format = format
                     break
 
-            if other is True:
-                files["other"].append(file)
-
-        if len(files["wav"]) > 0 or len(files["mp3"]) > 0:
-            self.items.append({
-                "id": os.path.basename(item_directory),
-                "path": item_directory,
-                "files": files
-            })
-        else:
-            self.errors["baroque_project"] = []
-            self.add_errors("baroque_project", "warning", item_directory, os.path.basename(item_directory), "item directory does not appear to be an audio recording")
+            files[file_format].append(file)
+            try:
+                stat = dir_entry.stat()
+                size, mtime_ns, inode = stat.st_size, stat.st_mtime_ns, stat.st_ino
+            except OSError as e:
+                size, mtime_ns, inode = 0, 0, 0
+                unreadable_files.append((dir_entry.path, e.strerror))
+            file_records[file] = {
+                "size": size,
+                "mtime_ns": mtime_ns,
+                "inode": inode,
+                "format": file_format,
+                "is_dir": dir_entry.is_dir()
+            }
+            # os.walk does not follow symbolic links to directories
+            if dir_entry.is_dir(follow_symlinks=False):
+                subdirectories.append(dir_entry.path)
+
+        nested_file_sizes = {}
+        for subdirectory in subdirectories:
+            for dirpath, dirnames, filenames in os.walk(subdirectory):
+                for filename in filenames:
+                    file_path = os.path.join(dirpath, filename)
+                    try:
+                        nested_file_sizes[file_path] = os.path.getsize(file_path)
+                    except OSError as e:
+                        unreadable_files.append((file_path, e.strerror))
+
+        return files, file_records, nested_file_sizes, unreadable_files
+
+    def get_intellectual_groups(self):
+        """
+        Group the md5, mp3, and wav files of each item into intellectual groups, which make up a digital part.
+        The groups are computed once per project and shared by every validator that needs them.
+        Return a dictionary with the following format:
+            {
+                item id (e.g., 85429-SR-1) :
+                {
+                    part id (e.g., 85429-SR-1-1) : DigitalPart(files, counts, other)
+                }
+            }
+        """
+        if self.intellectual_groups is not None:
+            return self.intellectual_groups
+
+        items = {}
+        for item in self.items:
+            parts = {}
+            for file_type, files in item["files"].items():
+                if file_type not in PART_FILE_TYPES:
+                    continue
+                for file in files:
+                    # Split file names into a part id and a format (e.g., "-am.wav").
+                    file_match = part_file_regex.match(file)
+                    if file_match:
+                        name, format = file_match.groups()
+
+                        # Create dictionary of intellectual groups
+                        if name not in parts:
+                            parts[name] = DigitalPart([], [0] * len(PART_FILE_FORMATS), [])
+                        part = parts[name]
+                        part.files.append(file)
+                        if format is None:
+                            part.other.append(file)
+                        else:
+                            part.counts[part_format_indexes[format]] += 1
+
+            if parts:
+                items[item["id"]] = parts
+
+        self.intellectual_groups = items
+        return items
 
     def _parse_collection_id(self, item_id):
         return item_id.split("-")[0] # NOTE: Collection IDs are parsed from item IDs
 
-    def _read_export(self, keys, rows, export_type):
+    def _read_export(self, keys, rows, columns):
+        """
+        Lazily yield the values of the given columns for each row of the metadata export.
+        Missing columns and short rows yield None, and rows without a value in the first column are skipped.
+        """
+        indexes = [keys.index(column) if column in keys else None for column in columns]
         for row in rows:
-            if export_type == ".csv":
-                values = row
-            elif export_type == ".xlsx":
-                values = [c.value for c in row]
-            yield dict(zip(keys, values))
+            values = tuple(row[index] if index is not None and index < len(row) else None for index in indexes)
+            if values[0]:
+                yield values
+
+    def load_metadata_export(self, metadata_export):
+        """
+        Return the parsed metadata export, loading it from a snapshot in the destination directory when the export is unchanged.
+        The snapshot is keyed on the export's absolute path, size, modification time and MD5 checksum,
+        and is rewritten whenever the export has to be parsed again.
+        """
+        if not os.path.exists(metadata_export):
+            print("SYSTEM ERROR: metadata export does not exist")
+            sys.exit()
+
+        stat = os.stat(metadata_export)
+        key = (METADATA_SNAPSHOT_VERSION, os.path.abspath(metadata_export), stat.st_size, stat.st_mtime_ns, md5_checksum(metadata_export))
+        path_to_snapshot = os.path.join(self.destination_directory, "baroque-export-snapshot.pickle")
+
+        if self.use_cache:
+            try:
+                with open(path_to_snapshot, "rb") as f:
+                    snapshot = pickle.load(f)
+                if snapshot["key"] == key:
+                    return snapshot["metadata"]
+            except Exception:
+                pass
+
+        metadata = self.parse_metadata_export(metadata_export)
+
+        # Write the snapshot to a temporary file first, so an interrupted run never leaves a truncated snapshot behind
+        try:
+            with open(path_to_snapshot + ".tmp", "wb") as f:
+                pickle.dump({"key": key, "metadata": metadata}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path_to_snapshot + ".tmp", path_to_snapshot)
+        except OSError:
+            print("SYSTEM ERROR: metadata export snapshot could not be written to destination_directory")
+
+        return metadata
 
     def parse_metadata_export(self, metadata_export):
         """
         This function parses the metadata export supplied by BHL to the vendor (either a CSV or xlsx file)
         It stores the values of the DigFile Calc, CollectionTitlte, ItemTitle, and ItemDate columns
+        The export is read as a stream, row by row, so memory use does not depend on the size of the export.
         """
         if not os.path.exists(metadata_export):
             print("SYSTEM ERROR: metadata export does not exist")
             sys.exit()
 
-        metadata = {"collections_ids": [], "items_ids": [], "item_metadata": {}}
+        # Both levels are indexed with ordered dictionaries, so looking up an id is O(1) regardless of the size of the export:
+        # - collections_ids : collection id -> list of the collection's item ids
+        # - item_metadata : item id -> the item's ItemMetadata
+        metadata = {"collections_ids": {}, "item_metadata": {}}
 
         item_id_column = "DigFile Calc"
         collection_title_column = "COLLECTIONS::CollectionTitle"
         item_title_column = "ItemTitle"
         item_date_column = "ItemDate"
+        columns = [item_id_column, collection_title_column, item_title_column, item_date_column]
 
         export_type = os.path.splitext(metadata_export)[1]
-        if export_type in [".csv", ".xlsx"]:
-            if export_type == ".csv":
-                with open(metadata_export, "r", newline="") as f:
-                    reader = csv.reader(f)
-                    keys = next(reader)
-                    rows = [row for row in reader]
-
-            elif export_type == ".xlsx":
-                # momentarily set warnings to ignore to hide openpyxl's "UserWarning: Workbook contains no default style" message
-                warnings.simplefilter("ignore")
-                workbook = load_workbook(metadata_export)
-                warnings.simplefilter("default")
-                sheet = workbook.active
-                reader = sheet.rows
-                keys = [c.value for c in next(reader)]
-                rows = [row for row in reader]
-                workbook.close()
-
-            for row in self._read_export(keys, rows, export_type):
-                item_id = row.get(item_id_column)
-                collection_id = self._parse_collection_id(item_id)
-                collection_title = row.get(collection_title_column)
-                item_title = row.get(item_title_column)
-                item_date = row.get(item_date_column)
-                metadata["items_ids"].append(item_id)
-                if collection_id not in metadata["collections_ids"]:
-                    metadata["collections_ids"].append(collection_id)
-                metadata["item_metadata"][item_id] = {
-                    "collection_title": collection_title,
-                    "item_title": item_title,
-                    "item_date": item_date
-                }
+        if export_type == ".csv":
+            with open(metadata_export, "r", newline="") as f:
+                reader = csv.reader(f)
+                keys = next(reader)
+                self._index_export(metadata, self._read_export(keys, reader, columns))
+
+        elif export_type == ".xlsx":
+            # openpyxl is slow to import, so it is only imported when an .xlsx metadata export is given
+            from openpyxl import load_workbook
+
+            # momentarily set warnings to ignore to hide openpyxl's "UserWarning: Workbook contains no default style" message
+            warnings.simplefilter("ignore")
+            workbook = load_workbook(metadata_export, read_only=True)
+            warnings.simplefilter("default")
+            sheet = workbook.active
+            reader = sheet.iter_rows(values_only=True)
+            keys = list(next(reader))
+            self._index_export(metadata, self._read_export(keys, reader, columns))
+            workbook.close()
 
         # File type: neither csv nor xlsx
         else:
@@ -255,11 +490,27 @@ class BaroqueProject(object):
 
         return metadata
 
+    def _index_export(self, metadata, rows):
+        """
+        Add the item ids, collection ids and item metadata from each row of the metadata export to metadata
+        """
+        for item_id, collection_title, item_title, item_date in rows:
+            collection_id = self._parse_collection_id(item_id)
+            if collection_id not in metadata["collections_ids"]:
+                metadata["collections_ids"][collection_id] = []
+            metadata["collections_ids"][collection_id].append(item_id)
+            metadata["item_metadata"][item_id] = ItemMetadata(collection_title, item_title, item_date)
+
+    @property
+    def errors(self):
+        """
+        The errors kept in memory by the error sink, organized by validation (empty if the error sink writes them out as they are found)"""
+        return self.error_sink.errors
+
     def add_errors(self, validation, error_type, path, id, error):
         """
-        Add errors, organized by validation, to the BaroqueProject error attribute.
-        Each validation (e.g., structure) has its own list of errors.
-        Each error message is a dictionary with five key, value pairs:
+        Add errors, organized by validation, to the BaroqueProject's error sink (see baroque/report_generation.py).
+        Each error has five parts:
         - validation : the validation step where the error was found
         - error_type : classification of the errror (either "requirement" or "warning")
         - path : where the error occurs (e.g., "C:\\Users\\person\\Desktop\\2019103\\12345")
@@ -267,10 +518,26 @@ class BaroqueProject(object):
         - error : a message describing the error (e.g., "empty directory", "empty file")
         """
 
-        self.errors[validation].append({
-                "validation": validation,
-                "error_type": error_type, # NOTE: Needs to be "requirement" or "warning".
-                "path": path,
-                "id": id,
-                "error": error
-            })
+        # NOTE: error_type needs to be "requirement" or "warning".
+        item_id = self.get_item_id(path, id)
+        self.error_sink.add(validation, error_type, path, id, error, item_id)
+        if self.manifest:
+            self.manifest.record(validation, error_type, path, id, error, item_id)
+
+    def get_item_id(self, path, id):
+        """
+        Return the id of the item that an error belongs to, or None if it does not belong to an item.
+        Most errors are reported against their item's id, but some are reported against a file name or a part id,
+        in which case the item is the one whose directory contains the error's path.
+        """
+        if id in self.items_by_id:
+            return id
+        if not path:
+            return None
+        path = os.path.abspath(path)
+        while path not in self.item_ids_by_path:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+        return self.item_ids_by_path[path]
@@ -1,10 +1,35 @@
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+
+def map_tasks(function, tasks, desc, jobs=1, initializer=None, initargs=()):
+    """
+    Run a module-level function on each task, either serially or spread across a number of worker processes.
+    Results are yielded in the same order as the tasks regardless of which worker finishes first,
+    so errors merged from them land in the BaroqueProject (and the CSV report) in a stable order.
+    If given, initializer is called with initargs in each worker process before it runs any task.
+    """
+    if jobs > 1 and len(tasks) > 1:
+        chunksize = max(1, len(tasks) // (jobs * 16))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as executor:
+            for result in tqdm(executor.map(function, tasks, chunksize=chunksize), total=len(tasks), desc=desc):
+                yield result
+    else:
+        for task in tqdm(tasks, desc=desc):
+            yield function(task)
+
+
 class BaroqueValidator:
-    def __init__(self, validation, validator, project):
+    # Validators that can run as part of a ValidationPipeline set this to a module-level function that validates one item,
+    # taking the task returned by "get_item_task" and returning the result passed to "add_item_result"
+    item_validator = None
+
+    def __init__(self, validation, validator, project, jobs=1):
         self.validation = validation
         self.validator = validator
         self.project = project
-        if self.validation not in self.project.errors.keys():
-            self.project.errors[validation] = []
+        self.jobs = jobs
+        self.project.error_sink.register(validation)
 
     def validate(self):
         self.validator()
@@ -16,3 +41,92 @@ class BaroqueValidator:
     def warn(self, path, id, message):
         error_type = "warning"
         self.project.add_errors(self.validation, error_type, path, id, message)
+
+    def get_items_to_validate(self):
+        """
+        Return an (item, cached) pair for every project item, in the order of the project's items.
+        When the project is validated incrementally, cached is True for items that are unchanged since the last run:
+        this validation does not run on them, and the errors cached for them in the project's run manifest are added instead,
+        with "add_item_results" or "add_cached_errors", in their place among the other items' errors."""
+        if self.project.manifest is None:
+            return [(item, False) for item in self.project.items]
+
+        items = []
+        for item in self.project.items:
+            cached = self.project.manifest.has_cached_errors(self.validation, item)
+            if not cached:
+                self.project.manifest.start(self.validation, item)
+            items.append((item, cached))
+
+        cached_items = sum(1 for item, cached in items if cached)
+        if cached_items:
+            print("SYSTEM REPORT: {} of {} item(s) unchanged since the last {} validation".format(cached_items, len(items), self.validation))
+        return items
+
+    def add_cached_errors(self, item):
+        """
+        Add the errors cached for an unchanged item in the project's run manifest to the BaroqueProject.
+        They are read from the manifest only now, so the cached errors of every item are never all in memory at once"""
+        self.add_collected_errors(self.project.manifest.get_cached_errors(self.validation, item))
+
+    def add_item_results(self, items, results):
+        """
+        Add the errors of every item to the BaroqueProject in the order of items, which are (item, cached) pairs
+        from "get_items_to_validate": the cached errors of unchanged items, and the results of the other items,
+        which are given in the same order, with "add_item_result"."""
+        results = iter(results)
+        for item, cached in items:
+            if cached:
+                self.add_cached_errors(item)
+            else:
+                self.add_item_result(item, next(results))
+        # Run the results to their end, so that "map_tasks" closes its progress bar and worker processes
+        next(results, None)
+
+    def add_collected_errors(self, errors):
+        """
+        Add errors collected by a ValidationContext to the BaroqueProject, in the order they were found"""
+        for error_type, path, id, message in errors:
+            self.project.add_errors(self.validation, error_type, path, id, message)
+
+    def map(self, function, tasks, desc):
+        """
+        Run a module-level function on each task with "map_tasks", spread across self.jobs worker processes"""
+        return map_tasks(function, tasks, desc, self.jobs)
+
+    def get_item_task(self, item):
+        """
+        Return the task that "item_validator" validates an item with"""
+        raise NotImplementedError
+
+    def get_worker_initializer(self):
+        """
+        Return an (initializer, initargs) pair that each ValidationPipeline worker process calls before validating items,
+        or None if "item_validator" needs no set up"""
+        return None
+
+    def add_item_result(self, item, result):
+        """
+        Add the result of running "item_validator" on an item to the BaroqueProject"""
+        self.add_collected_errors(result)
+
+    def finish(self):
+        """
+        Called by ValidationPipeline once every item has been validated"""
+        pass
+
+
+class ValidationContext:
+    """
+    Collects the errors found while validating a single file or item.
+    Validation steps that run in worker processes do their checks on a ValidationContext instead of a BaroqueValidator,
+    and the collected errors are merged into the BaroqueProject afterwards with "add_collected_errors".
+    """
+    def __init__(self):
+        self.errors = []
+
+    def error(self, path, id, message):
+        self.errors.append(("requirement", path, id, message))
+
+    def warn(self, path, id, message):
+        self.errors.append(("warning", path, id, message))
@@ -0,0 +1,154 @@
+import os
+import struct
+
+
+# Fields returned by "read_bext_chunk", in the same order as the columns of BWF MetaEdit's "--out-core" CSV.
+BEXT_FIELDS = [
+    "FileName",
+    "Description",
+    "Originator",
+    "OriginatorReference",
+    "OriginationDate",
+    "OriginationTime",
+    "TimeReference (translated)",
+    "TimeReference",
+    "BextVersion",
+    "UMID",
+    "LoudnessValue",
+    "LoudnessRange",
+    "MaxTruePeakLevel",
+    "MaxMomentaryLoudness",
+    "MaxShortTermLoudness",
+    "CodingHistory",
+]
+INFO_FIELDS = [
+    "IARL", "IART", "ICMS", "ICMT", "ICOP", "ICRD", "IENG", "IGNR", "IKEY",
+    "IMED", "INAM", "IPRD", "ISBJ", "ISFT", "ISRC", "ISRF", "ITCH"
+]
+
+# Layout of the fixed-length part of a bext chunk (EBU Tech 3285), which is followed by the CodingHistory.
+BEXT_STRUCT = struct.Struct("<256s32s32s10s8sIIH64s5h180s")
+RF64_SIZE_PLACEHOLDER = 0xFFFFFFFF
+
+
+class WavChunkError(Exception):
+    """
+    Raised when a file cannot be walked as a RIFF/RF64 WAV file."""
+    pass
+
+
+def _decode(value):
+    """
+    Helper function to decode a fixed-length, NUL-padded bext/INFO string"""
+    value = value.split(b"\x00", 1)[0]
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("latin-1")
+
+
+def _translate_time_reference(time_reference, sample_rate):
+    """
+    Helper function to express a sample count as HH:MM:SS.mmm, as BWF MetaEdit does"""
+    milliseconds = time_reference * 1000 // sample_rate
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{:02d}:{:02d}:{:02d}.{:03d}".format(hours, minutes, seconds, milliseconds)
+
+
+def _parse_bext(body, row):
+    """
+    Parses the body of a bext chunk into the BWF MetaEdit field names"""
+    if len(body) < BEXT_STRUCT.size:
+        body = body.ljust(BEXT_STRUCT.size, b"\x00")
+    (description, originator, originator_reference, origination_date, origination_time,
+        time_reference_low, time_reference_high, version, umid,
+        loudness_value, loudness_range, max_true_peak_level, max_momentary_loudness, max_short_term_loudness,
+        _) = BEXT_STRUCT.unpack_from(body)
+
+    row["Description"] = _decode(description)
+    row["Originator"] = _decode(originator)
+    row["OriginatorReference"] = _decode(originator_reference)
+    row["OriginationDate"] = _decode(origination_date)
+    row["OriginationTime"] = _decode(origination_time)
+    row["TimeReference"] = str((time_reference_high << 32) | time_reference_low)
+    row["BextVersion"] = str(version)
+    row["UMID"] = umid.hex().upper() if umid.strip(b"\x00") else ""
+    # Loudness metadata was only added in version 2 of the bext chunk
+    if version >= 2:
+        row["LoudnessValue"] = "{:.2f}".format(loudness_value / 100)
+        row["LoudnessRange"] = "{:.2f}".format(loudness_range / 100)
+        row["MaxTruePeakLevel"] = "{:.2f}".format(max_true_peak_level / 100)
+        row["MaxMomentaryLoudness"] = "{:.2f}".format(max_momentary_loudness / 100)
+        row["MaxShortTermLoudness"] = "{:.2f}".format(max_short_term_loudness / 100)
+    row["CodingHistory"] = _decode(body[BEXT_STRUCT.size:])
+
+
+def _parse_info(body, row):
+    """
+    Parses the subchunks of a LIST/INFO chunk into the BWF MetaEdit field names"""
+    offset = 4
+    while offset + 8 <= len(body):
+        subchunk_id, subchunk_size = struct.unpack_from("<4sI", body, offset)
+        offset += 8
+        row[subchunk_id.decode("latin-1")] = _decode(body[offset:offset + subchunk_size])
+        offset += subchunk_size + (subchunk_size & 1)
+
+
+def read_bext_chunk(path_to_wav):
+    """
+    Reads the bext and LIST/INFO chunks of a RIFF or RF64 WAV file without reading its audio data.
+
+    Returns a dictionary with the same fields as a row of BWF MetaEdit's "--out-core" CSV.
+    Fields that are absent from the file (e.g., everything but FileName when there is no bext chunk) are empty strings.
+    """
+    row = dict.fromkeys(BEXT_FIELDS + INFO_FIELDS, "")
+    row["FileName"] = path_to_wav
+
+    with open(path_to_wav, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        header = f.read(12)
+        if len(header) < 12 or header[8:12] != b"WAVE" or header[:4] not in (b"RIFF", b"RF64", b"BW64"):
+            raise WavChunkError("{} is not a RIFF/RF64 WAV file".format(path_to_wav))
+
+        rf64_sizes = {}
+        sample_rate = None
+        offset = 12
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            chunk_id, chunk_size = struct.unpack("<4sI", f.read(8))
+
+            # RF64 files store the real size of large chunks in the ds64 chunk
+            if chunk_size == RF64_SIZE_PLACEHOLDER and chunk_id in rf64_sizes:
+                chunk_size = rf64_sizes[chunk_id]
+
+            if chunk_id == b"ds64":
+                body = f.read(chunk_size)
+                if len(body) >= 28:
+                    _, data_size, _, table_length = struct.unpack_from("<QQQI", body)
+                    rf64_sizes[b"data"] = data_size
+                    for n in range(table_length):
+                        entry_offset = 28 + n * 12
+                        if entry_offset + 12 > len(body):
+                            break
+                        table_id, table_size = struct.unpack_from("<4sQ", body, entry_offset)
+                        rf64_sizes[table_id] = table_size
+            elif chunk_id == b"fmt ":
+                body = f.read(min(chunk_size, 16))
+                if len(body) >= 8:
+                    sample_rate = struct.unpack_from("<I", body, 4)[0]
+            elif chunk_id == b"bext":
+                _parse_bext(f.read(chunk_size), row)
+            elif chunk_id == b"LIST":
+                if f.read(4) == b"INFO":
+                    f.seek(offset + 8)
+                    _parse_info(f.read(chunk_size), row)
+
+            # Chunks are word-aligned, so odd-sized chunks are followed by a pad byte
+            offset += 8 + chunk_size + (chunk_size & 1)
+
+    if row["TimeReference"] and sample_rate:
+        row["TimeReference (translated)"] = _translate_time_reference(int(row["TimeReference"]), sample_rate)
+
+    return row
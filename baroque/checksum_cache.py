@@ -0,0 +1,54 @@
+import os
+import sqlite3
+
+
+class ChecksumCache:
+    """
+    Stores the MD5 checksums calculated by ChecksumValidator in a SQLite database in the destination directory.
+
+    Each checksum is stored with the stat signature (size, modification time and inode) of the file it was calculated from,
+    as recorded in the item's "file_records" by BaroqueProject.
+    A cached checksum is only used while the file's current stat signature still matches,
+    so any file that was replaced or modified since it was last hashed is hashed again.
+    """
+
+    filename = "baroque-checksums.sqlite3"
+
+    def __init__(self, destination_directory):
+        self.path = os.path.join(destination_directory, self.filename)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS checksums ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, inode INTEGER, md5 TEXT)"
+        )
+        self.pending = 0
+
+    def _signature(self, file_record):
+        return file_record["size"], file_record["mtime_ns"], file_record["inode"]
+
+    def get(self, path, file_record):
+        """
+        Return the cached checksum of a file, or None if it was never hashed or its stat signature has changed"""
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, inode, md5 FROM checksums WHERE path = ?", (os.path.abspath(path),)
+        ).fetchone()
+        if row and tuple(row[:3]) == self._signature(file_record):
+            return row[3]
+        return None
+
+    def set(self, path, file_record, checksum):
+        """
+        Store the checksum of a file along with the stat signature it was calculated from"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO checksums (path, size, mtime_ns, inode, md5) VALUES (?, ?, ?, ?, ?)",
+            (os.path.abspath(path),) + self._signature(file_record) + (checksum,)
+        )
+        # Commit in batches so an interrupted run keeps most of its work without paying for a commit per file
+        self.pending += 1
+        if self.pending >= 100:
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
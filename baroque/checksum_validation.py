@@ -1,11 +1,313 @@
-from .baroque_validator import BaroqueValidator
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from tqdm import tqdm
+
+from .baroque_validator import BaroqueValidator, ValidationContext
+from .checksum_cache import ChecksumCache
+from .utils import CHUNK_SIZE, md5_checksum
+
+
+md5_regex = re.compile(r"^[0-9a-fA-F]{32}$")
+
+
+# Each worker process allocates its hashing buffer once and reuses it for every file it hashes.
+_worker_buffer = None
+# Shared by the worker processes of a ValidationPipeline to cap the number of files hashed at once (see "set_read_semaphore")
+_read_semaphore = None
+
+
+def set_read_semaphore(semaphore):
+    """
+    Set the semaphore that "validate_item_checksums" holds while hashing a file, in a ValidationPipeline worker process"""
+    global _read_semaphore
+    _read_semaphore = semaphore
+
+
+def hash_file(path_to_file):
+    """
+    Hash one file in a worker process.
+    Returns a (checksum, seconds) tuple, or (None, 0) if the file cannot be read."""
+    global _worker_buffer
+    if _worker_buffer is None:
+        _worker_buffer = bytearray(CHUNK_SIZE)
+    start = time.perf_counter()
+    try:
+        checksum = md5_checksum(path_to_file, _worker_buffer)
+    except OSError:
+        return None, 0
+    return checksum, time.perf_counter() - start
+
+
+def read_md5_sidecar(path_to_md5):
+    """
+    Read the checksum from a .md5 sidecar file.
+    Sidecars contain either just the checksum or the checksum followed by the file name (e.g., "d41d8cd98f00b204e9800998ecf8427e *0648-SR-4-1-am.wav").
+    Returns None if the sidecar cannot be read or does not start with an MD5 checksum."""
+    try:
+        with open(path_to_md5, "r", encoding="utf-8-sig") as f:
+            text = f.read(4096)
+    except (OSError, UnicodeDecodeError):
+        return None
+
+    tokens = text.split()
+    if tokens and md5_regex.match(tokens[0]):
+        return tokens[0].lower()
+    return None
+
+
+class ChecksumItem(ValidationContext):
+    """
+    Reads and checks the .md5 sidecars of a single item, collecting errors rather than adding them to a BaroqueProject
+    so that items can be verified in worker processes.
+    """
+    def __init__(self, item):
+        super().__init__()
+        self.item = item
+
+    def check_sidecars_exist(self):
+        """
+        Check that every wav and mp3 file has a .md5 sidecar and that every .md5 sidecar has a file to verify.
+        Returns a list of (file, sidecar) pairs that can be verified."""
+        item = self.item
+        md5_files = set(item["files"]["md5"])
+        pairs = []
+
+        for file in item["files"]["wav"] + item["files"]["mp3"]:
+            md5_file = file + ".md5"
+            if md5_file in md5_files:
+                pairs.append((file, md5_file))
+            else:
+                self.error(
+                    os.path.join(item["path"], file),
+                    item["id"],
+                    "file has no md5 sidecar"
+                )
+
+        item_files = set(file for files in item["files"].values() for file in files)
+        for md5_file in item["files"]["md5"]:
+            file = md5_file[:-len(".md5")]
+            if file not in item_files:
+                self.error(
+                    os.path.join(item["path"], md5_file),
+                    item["id"],
+                    "md5 sidecar has no corresponding file: '{}'".format(file)
+                )
+            elif not (file.lower().endswith(".wav") or file.lower().endswith(".mp3")):
+                pairs.append((file, md5_file))
+
+        return pairs
+
+    def get_checksums_to_verify(self):
+        """
+        Read the item's .md5 sidecars and return a list of (file, expected checksum) tuples"""
+        checksums = []
+        for file, md5_file in self.check_sidecars_exist():
+            path_to_md5 = os.path.join(self.item["path"], md5_file)
+            expected = read_md5_sidecar(path_to_md5)
+            if expected is None:
+                self.error(
+                    path_to_md5,
+                    self.item["id"],
+                    "md5 sidecar is malformed"
+                )
+            else:
+                checksums.append((file, expected))
+
+        return checksums
+
+    def check_checksum(self, file, expected, actual):
+        """
+        Compare a file's calculated checksum to the checksum in its .md5 sidecar"""
+        path_to_file = os.path.join(self.item["path"], file)
+        if actual is None:
+            self.error(
+                path_to_file,
+                self.item["id"],
+                "file could not be read to calculate checksum"
+            )
+        elif actual != expected:
+            self.error(
+                path_to_file,
+                self.item["id"],
+                "checksum {} does not match {} in md5 sidecar".format(actual, expected)
+            )
+
+
+def validate_item_checksums(task):
+    """
+    Verifies the checksums of one item and returns the errors found, the checksums that had to be calculated,
+    and the number of seconds each of them took to calculate.
+    Takes a single (item, sidecar_errors, checksums) task so it can be used in a ValidationPipeline,
+    where the item's .md5 sidecars have already been read (see "ChecksumValidator.get_item_task"):
+    sidecar_errors are the errors found reading them, and checksums is a list of (file, expected checksum, cached checksum) tuples,
+    with a cached checksum of None for files that need to be hashed.
+    Files are hashed while holding the worker's read semaphore, if it has one."""
+    item, sidecar_errors, checksums = task
+    checksum_item = ChecksumItem(item)
+    checksum_item.errors.extend(sidecar_errors)
+    new_checksums = {}
+    hash_seconds = {}
+    for file, expected, actual in checksums:
+        if actual is None:
+            path_to_file = os.path.join(item["path"], file)
+            if _read_semaphore is None:
+                actual, seconds = hash_file(path_to_file)
+            else:
+                with _read_semaphore:
+                    actual, seconds = hash_file(path_to_file)
+            if actual is not None:
+                new_checksums[file] = actual
+                hash_seconds[file] = seconds
+        checksum_item.check_checksum(file, expected, actual)
+    return checksum_item.errors, new_checksums, hash_seconds
+
 
 class ChecksumValidator(BaroqueValidator):
-    def __init__(self, project):
+    item_validator = staticmethod(validate_item_checksums)
+
+    def __init__(self, project, jobs=1, readers=None, use_cache=True):
         validation = "checksum"
         validator = self.validate_checksums
-        super().__init__(validation, validator, project)
-    
+        super().__init__(validation, validator, project, jobs)
+        # The number of files hashed at once is capped separately from the number of worker processes,
+        # so that spinning disks and network shares are not thrashed by too many concurrent readers.
+        self.readers = max(1, readers or jobs)
+        # When the cache is not used, every file is hashed again, but the cache is still refreshed for the next run.
+        self.use_cache = use_cache
+        # Opened by "get_item_task" when items are verified in a ValidationPipeline, and closed by "finish"
+        self.cache = None
+        # Counts of the files with a well-formed .md5 sidecar, and of those whose checksum is cached, in a ValidationPipeline
+        self.cached_files = 0
+        self.verified_files = 0
+        # Number of bytes to hash in a ValidationPipeline, and the progress bar opened by the first "add_item_result"
+        self.bytes_to_hash = 0
+        self.progress = None
+
+    def get_item_task(self, item):
+        """
+        Returns the task to run "validate_item_checksums" on for an item.
+        The item's .md5 sidecars are read here, so that only the files they give a checksum for are counted and looked up in the cache."""
+        if self.cache is None:
+            self.cache = ChecksumCache(self.project.destination_directory)
+
+        checksum_item = ChecksumItem(item)
+        checksums = []
+        for file, expected in checksum_item.get_checksums_to_verify():
+            file_record = item["file_records"][file]
+            cached_checksum = self.cache.get(os.path.join(item["path"], file), file_record) if self.use_cache else None
+            if cached_checksum is None:
+                self.bytes_to_hash += file_record["size"]
+            else:
+                self.cached_files += 1
+            checksums.append((file, expected, cached_checksum))
+        self.verified_files += len(checksums)
+        return item, checksum_item.errors, checksums
+
+    def get_worker_initializer(self):
+        """
+        Give every ValidationPipeline worker process the same semaphore, so that at most self.readers files are hashed at once"""
+        return set_read_semaphore, (multiprocessing.Semaphore(self.readers),)
+
+    def add_item_result(self, item, result):
+        errors, new_checksums, hash_seconds = result
+        if self.progress is None:
+            self.progress = tqdm(total=self.bytes_to_hash, desc="Checksum Validation", unit="B", unit_scale=True, unit_divisor=1024)
+        for file, checksum in new_checksums.items():
+            file_record = item["file_records"][file]
+            self.cache.set(os.path.join(item["path"], file), file_record, checksum)
+            self.progress.update(file_record["size"])
+            if hash_seconds[file] > 0:
+                self.progress.set_postfix_str("{}: {:.1f} MB/s".format(file, file_record["size"] / hash_seconds[file] / 1e6), refresh=False)
+        self.add_collected_errors(errors)
+
+    def finish(self):
+        if self.progress is not None:
+            self.progress.close()
+            self.progress = None
+        if self.cached_files:
+            print("SYSTEM REPORT: {} of {} file(s) unchanged since their checksums were cached".format(self.cached_files, self.verified_files))
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def hash_files(self, paths):
+        """
+        Hash files on a pool of self.jobs worker processes with at most self.readers files open at once.
+        Results are yielded in the same order as paths."""
+        if self.jobs <= 1:
+            for path in paths:
+                yield hash_file(path)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            pending = {}
+            results = {}
+            next_submit = 0
+            next_yield = 0
+            while next_yield < len(paths):
+                while next_submit < len(paths) and len(pending) < self.readers:
+                    pending[executor.submit(hash_file, paths[next_submit])] = next_submit
+                    next_submit += 1
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[pending.pop(future)] = future.result()
+                while next_yield in results:
+                    yield results.pop(next_yield)
+                    next_yield += 1
+
     def validate_checksums(self):
-        """ Validates checksums """
-        pass
+        """
+        Validates checksums of wav and mp3 files against their .md5 sidecars.
+        Files are hashed across self.jobs worker processes, and each item's errors are added together, in the order of items,
+        as "validate_item_checksums" finds them in a ValidationPipeline."""
+        cache = ChecksumCache(self.project.destination_directory)
+
+        # Read the .md5 sidecars of every item, and look up each file's stat signature in the cache,
+        # so that only the files that are not cached or have changed are hashed
+        items = self.get_items_to_validate()
+        checksum_items = []
+        paths_to_hash = []
+        total = 0
+        verified_files = 0
+        for item, cached in items:
+            if cached:
+                continue
+            checksum_item = ChecksumItem(item)
+            checksums = []
+            for file, expected in checksum_item.get_checksums_to_verify():
+                file_record = item["file_records"][file]
+                cached_checksum = cache.get(os.path.join(item["path"], file), file_record) if self.use_cache else None
+                if cached_checksum is None:
+                    paths_to_hash.append(os.path.join(item["path"], file))
+                    total += file_record["size"]
+                checksums.append((file, expected, cached_checksum))
+            verified_files += len(checksums)
+            checksum_items.append((checksum_item, checksums))
+
+        if len(paths_to_hash) < verified_files:
+            print("SYSTEM REPORT: {} of {} file(s) unchanged since their checksums were cached".format(verified_files - len(paths_to_hash), verified_files))
+
+        hashed = self.hash_files(paths_to_hash)
+        checksum_items = iter(checksum_items)
+        with tqdm(total=total, desc="Checksum Validation", unit="B", unit_scale=True, unit_divisor=1024) as progress:
+            for item, cached in items:
+                if cached:
+                    self.add_cached_errors(item)
+                    continue
+                checksum_item, checksums = next(checksum_items)
+                for file, expected, actual in checksums:
+                    if actual is None:
+                        actual, seconds = next(hashed)
+                        if actual is not None:
+                            file_record = item["file_records"][file]
+                            cache.set(os.path.join(item["path"], file), file_record, actual)
+                            progress.update(file_record["size"])
+                            if seconds > 0:
+                                progress.set_postfix_str("{}: {:.1f} MB/s".format(file, file_record["size"] / seconds / 1e6), refresh=False)
+                    checksum_item.check_checksum(file, expected, actual)
+                self.add_collected_errors(checksum_item.errors)
+
+        cache.close()
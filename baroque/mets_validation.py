@@ -1,12 +1,10 @@
 import os
 import re
 from lxml import etree
-import dateparser
 import sys
-from tqdm import tqdm
 
-from .baroque_validator import BaroqueValidator
-from .utils import sanitize_text
+from .baroque_validator import BaroqueValidator, ValidationContext
+from .utils import normalize_date, sanitize_text
 
 # Note: Some namespaces referenced in the example XML files are not used in the METS file. Unless I'm missing some, these are: fits, fn, rights, marc21 and  tcf.
 namespaces = {
@@ -19,11 +17,104 @@ namespaces = {
 }
 
 
-class MetsValidator(BaroqueValidator):
-    def __init__(self, project):
-        validation = "mets"
-        validator = self.validate_mets
-        super().__init__(validation, validator, project)
+# The paths checked in every item's METS are compiled into XPath expressions with the namespaces bound
+# the first time they are used, and the compiled expressions are reused for every item validated by the process.
+_compiled_paths = {}
+
+
+def compile_path(path):
+    """
+    Returns the compiled XPath expression for a METS path, compiling it on first use"""
+    compiled_path = _compiled_paths.get(path)
+    if compiled_path is None:
+        compiled_path = _compiled_paths[path] = etree.XPath(path, namespaces=namespaces)
+    return compiled_path
+
+
+def find_first(element, path):
+    """
+    Returns the first element matching a path, or None, like Element.find"""
+    elements = compile_path(path)(element)
+    return elements[0] if elements else None
+
+
+def clark(path):
+    """
+    Converts a path of prefixed tags (e.g., "mets:techMD/mets:mdRef") into a tuple of {namespace}tag names"""
+    tags = []
+    for tag in path.split("/"):
+        prefix, name = tag.split(":")
+        tags.append("{" + namespaces[prefix] + "}" + name)
+    return tuple(tags)
+
+
+# When METS is streamed, these are the only sections of the METS kept in memory.
+# The other elements directly under the root element, and every element in them, are discarded as soon as they have been parsed.
+streamed_sections = set(clark(section)[0] for section in ["mets:metsHdr", "mets:dmdSec", "mets:amdSec", "mets:fileSec", "mets:structMap"])
+# amdSec can hold huge techMD and processHistory sections, so only the elements that the amdSec checks look at are kept from it.
+# Any other element in amdSec is discarded as soon as it has been parsed, unless it is on one of these paths from amdSec.
+streamed_amdsec_paths = [clark(path) for path in [
+    "mets:techMD/mets:mdRef",
+    "mets:techMD/mets:mdWrap/mets:xmlData/aes:audioObject/aes:primaryIdentifier",
+    "mets:sourceMD",
+    "mets:digiprovMD"
+]]
+amdsec_tag = clark("mets:amdSec")[0]
+
+
+def is_streamed_element_kept(tags):
+    """
+    Returns whether an element, given the tags of the elements from the root element down to it, is kept when METS is streamed"""
+    # Elements in a discarded section are discarded too, so that they are not all held in memory until the section ends
+    if tags[1] not in streamed_sections:
+        return False
+    if len(tags) > 2 and tags[1] == amdsec_tag:
+        path = tuple(tags[2:])
+        return any(path == kept_path[:len(path)] for kept_path in streamed_amdsec_paths)
+    return True
+
+
+def stream_mets(path_to_mets):
+    """
+    Parses METS with etree.iterparse, discarding every element that the METS checks do not look at as soon as it has been parsed,
+    so that memory use does not grow with the size of the amdSec.
+    Returns the pruned tree, on which the METS checks find the same elements as on the fully parsed tree."""
+    tags = []
+    context = etree.iterparse(path_to_mets, events=("start", "end"))
+    for event, element in context:
+        if event == "start":
+            tags.append(element.tag)
+        else:
+            if len(tags) > 1 and not is_streamed_element_kept(tags):
+                element.clear()
+                element.getparent().remove(element)
+            tags.pop()
+    return context.root.getroottree()
+
+
+# Each worker process creates its XML parser once and reuses it for every METS file it parses.
+_worker_parser = None
+
+
+def get_parser():
+    """
+    Returns the XML parser of the current process, creating it on first use"""
+    global _worker_parser
+    if _worker_parser is None:
+        _worker_parser = etree.XMLParser()
+    return _worker_parser
+
+
+class MetsItem(ValidationContext):
+    """
+    Validates the METS of a single item, collecting errors rather than adding them to a BaroqueProject
+    so that items can be validated in worker processes.
+    """
+    def __init__(self, item, item_metadata, streaming=False):
+        super().__init__()
+        self.item = item
+        self.item_metadata = item_metadata
+        self.streaming = streaming
 
     def check_tag_text(self, tag, argument, value=None):
         """
@@ -78,7 +169,7 @@ class MetsValidator(BaroqueValidator):
     def check_element_exists(self, element_path):
         """
         Helper function to check if a specific element exists"""
-        elements = self.tree.xpath(element_path, namespaces=namespaces)
+        elements = compile_path(element_path)(self.tree)
         element = None
         exists = True
         if len(elements) == 0:
@@ -105,7 +196,7 @@ class MetsValidator(BaroqueValidator):
         Helper function that checks if one or more of a given subelement exist
         Optionally takes an expected parameter to check for an exact number of subelements
         Returns a list of all matching subelements"""
-        subelements = element.findall(subelement_path, namespaces=namespaces)
+        subelements = compile_path(subelement_path)(element)
         exist = True
         if expected and (len(subelements) != expected):
             self.error(
@@ -131,7 +222,8 @@ class MetsValidator(BaroqueValidator):
         if metadata_date == "Undated" and mets_date == "undated":
             pass
         # Trying to get around character encoding issues at the end of dates discovered during testing
-        if dateparser.parse(metadata_date) != dateparser.parse(mets_date) and dateparser.parse(metadata_date[:-1]) != dateparser.parse(mets_date):
+        mets_date_normalized = normalize_date(mets_date)
+        if normalize_date(metadata_date) != mets_date_normalized and normalize_date(metadata_date[:-1]) != mets_date_normalized:
             self.error(
                     self.path_to_mets,
                     self.item_id,
@@ -142,7 +234,7 @@ class MetsValidator(BaroqueValidator):
         """
         Helper function to check if a subelement exists
         Returns a single subelement"""
-        subelement = element.find(subelement_path, namespaces=namespaces)
+        subelement = find_first(element, subelement_path)
         exists = True
         if subelement is None:
             self.error(
@@ -238,10 +330,10 @@ class MetsValidator(BaroqueValidator):
                     xmlData, exists = self.check_subelement_exists(mdWrap, "mets:xmlData")
                     if exists:
 
-                        if self.item_metadata.get("item_title"):
+                        if self.item_metadata.item_title:
                             dc_title, exists = self.check_subelement_exists(xmlData, "dc:title")
                             if exists:
-                                self.check_tag_text(dc_title, "Is", self.item_metadata["item_title"])
+                                self.check_tag_text(dc_title, "Is", self.item_metadata.item_title)
                         else:
                             self.warn(
                                 self.path_to_mets,
@@ -249,10 +341,10 @@ class MetsValidator(BaroqueValidator):
                                 "item title not found in metadata export spreadsheet to validate against mets xml"
                             )
 
-                        if self.item_metadata.get("collection_title"):
+                        if self.item_metadata.collection_title:
                             dc_relation, exists = self.check_subelement_exists(xmlData, "dc:relation")
                             if exists:
-                                self.check_tag_text(dc_relation, "Is", self.item_metadata["collection_title"])
+                                self.check_tag_text(dc_relation, "Is", self.item_metadata.collection_title)
                         else:
                             self.warn(
                                 self.path_to_mets,
@@ -264,10 +356,10 @@ class MetsValidator(BaroqueValidator):
                         if exists:
                             self.check_tag_text(dc_identifier, "Is", self.item_id)
 
-                        if self.item_metadata.get("item_date"):
+                        if self.item_metadata.item_date:
                             dc_date, exists = self.check_subelement_exists(xmlData, "dc:date")
                             if exists:
-                                self.check_dates(self.item_metadata["item_date"], dc_date.text)
+                                self.check_dates(self.item_metadata.item_date, dc_date.text)
                         else:
                             self.warn(
                                 self.path_to_mets,
@@ -298,7 +390,7 @@ class MetsValidator(BaroqueValidator):
             if exist:
                 found_files = []
                 for techMD in techMDs:
-                    if techMD.find("mets:mdRef", namespaces=namespaces) is None:
+                    if find_first(techMD, "mets:mdRef") is None:
                         primary_identifier_element, exists = self.check_subelement_exists(techMD, "./mets:mdWrap/mets:xmlData/aes:audioObject/aes:primaryIdentifier")
                         if exists:
                             found_files.append(primary_identifier_element.text)                    
@@ -347,7 +439,7 @@ class MetsValidator(BaroqueValidator):
                     expected_files = self.item_files["wav"] + self.item_files["mp3"]
                     file_pointers = []
                     for sub_div in sub_divs:
-                        fptrs = sub_div.findall("mets:fptr", namespaces=namespaces)
+                        fptrs = compile_path("mets:fptr")(sub_div)
                         for fptr in fptrs:
                             file_id = fptr.attrib.get("FILEID").replace("mdp.", "").strip()
                             file_pointers.append(file_id)
@@ -358,19 +450,21 @@ class MetsValidator(BaroqueValidator):
                             "mets structMap fileptr IDs {} do not match expected {}".format(file_pointers, expected_files)
                         )
 
-    def parse_item_mets(self, item):
+    def parse_item_mets(self):
         """
-        Parses item METS"""
+        Parses item METS, streaming it if self.streaming is set"""
 
-        path_to_item = item['path']
-        mets = item['files']['xml'][0]
+        path_to_item = self.item['path']
+        mets = self.item['files']['xml'][0]
 
-        self.item_id = item['id']
-        self.item_files = item["files"]
-        self.item_metadata = self.project.metadata["item_metadata"].get(self.item_id)
+        self.item_id = self.item['id']
+        self.item_files = self.item["files"]
         self.path_to_mets = os.path.join(path_to_item, mets)
         try:
-            self.tree = etree.parse(self.path_to_mets)
+            if self.streaming:
+                self.tree = stream_mets(self.path_to_mets)
+            else:
+                self.tree = etree.parse(self.path_to_mets, get_parser())
             return True
         except:
             self.error(
@@ -380,20 +474,47 @@ class MetsValidator(BaroqueValidator):
             )
             return False
 
-    def validate_mets(self):
+
+def validate_item_mets(task):
+    """
+    Validates the METS of one item and returns the errors found.
+    Takes a single (item, item_metadata, streaming) task so it can be used with MetsValidator.map"""
+    item, item_metadata, streaming = task
+
+    # Assuming for now that validating directory and file structure would have picked this up
+    if not item['files']['xml']:
+        return []
+
+    mets = MetsItem(item, item_metadata, streaming)
+    if mets.parse_item_mets():
+        mets.validate_root_element()
+        mets.validate_mets_header()
+        mets.validate_descriptive_metadata()
+        mets.validate_administrative_metadata()
+        mets.validate_file_section()
+        mets.validate_structural_map_section()
+    return mets.errors
+
+
+class MetsValidator(BaroqueValidator):
+    item_validator = staticmethod(validate_item_mets)
+
+    def __init__(self, project, jobs=1, streaming=False):
+        validation = "mets"
+        validator = self.validate_mets
+        super().__init__(validation, validator, project, jobs)
+        # Stream each METS with etree.iterparse instead of parsing it into a full tree
+        self.streaming = streaming
+
+    def get_item_task(self, item):
         """
-        Validates METS"""
+        Returns the task to run "validate_item_mets" on for an item"""
+        return item, self.project.metadata["item_metadata"].get(item["id"]), self.streaming
 
-        for item in tqdm(self.project.items, desc="METS Validation"):
+    def validate_mets(self):
+        """
+        Validates METS, spreading items across self.jobs worker processes"""
 
-            # Assuming for now that validating directory and file structure would have picked this up
-            if not item['files']['xml']:
-                continue
-            else:
-                if self.parse_item_mets(item):
-                    self.validate_root_element()
-                    self.validate_mets_header()
-                    self.validate_descriptive_metadata()
-                    self.validate_administrative_metadata()
-                    self.validate_file_section()
-                    self.validate_structural_map_section()
+        items = self.get_items_to_validate()
+        tasks = [self.get_item_task(item) for item, cached in items if not cached]
+        self.add_item_results(items, self.map(validate_item_mets, tasks, desc="METS Validation"))
@@ -0,0 +1,63 @@
+from .baroque_validator import map_tasks
+
+
+def run_initializers(initializers):
+    """
+    Set up a ValidationPipeline worker process for each of its validators, calling their (initializer, initargs) pairs"""
+    for initializer, initargs in initializers:
+        initializer(*initargs)
+
+
+def validate_item(task):
+    """
+    Runs every requested validation on one item while its files are warm in the operating system's cache.
+    Takes a list of (item_validator, validation task) pairs and returns the results in the same order"""
+    return [item_validator(validation_task) for item_validator, validation_task in task]
+
+
+class ValidationPipeline:
+    """
+    Runs several validators in a single pass over the project's items instead of one pass per validator.
+    Each item is validated by all of the validators at once, with items spread across a number of worker processes,
+    so that an item's directory is read once per run rather than once per validation.
+
+    Only validators with an "item_validator" can be pipelined. Results are handed back to each validator's "add_item_result"
+    in the order of the project's items, so each validation's errors are reported in a stable order.
+    """
+    def __init__(self, validators, jobs=1):
+        self.validators = validators
+        self.jobs = jobs
+
+    def validate(self):
+        project = self.validators[0].project
+
+        # Each validator decides which items it needs to run on, so that incremental runs can skip unchanged items per validation.
+        # Every validator returns an (item, cached) pair for each of the project's items, in the same order.
+        validator_items = [validator.get_items_to_validate() for validator in self.validators]
+
+        tasks = []
+        item_validators = []
+        for item_index, item in enumerate(project.items):
+            validators = [validator for validator, items in zip(self.validators, validator_items) if not items[item_index][1]]
+            if validators:
+                tasks.append([(validator.item_validator, validator.get_item_task(item)) for validator in validators])
+            item_validators.append(validators)
+
+        initializers = [validator.get_worker_initializer() for validator in self.validators]
+        initializers = [initializer for initializer in initializers if initializer is not None]
+        item_results = map_tasks(validate_item, tasks, "Pipelined Validation", self.jobs, run_initializers, (initializers,))
+
+        # Each item's errors are added in the order of the validators, whether they were cached or just found,
+        # so that a report only changes where items changed
+        for item, validators in zip(project.items, item_validators):
+            results = dict(zip(validators, next(item_results))) if validators else {}
+            for validator in self.validators:
+                if validator in results:
+                    validator.add_item_result(item, results[validator])
+                else:
+                    validator.add_cached_errors(item)
+        # Run the results to their end, so that "map_tasks" closes its progress bar and worker processes
+        next(item_results, None)
+
+        for validator in self.validators:
+            validator.finish()
@@ -1,31 +1,265 @@
 import csv
 import os
+import sys
 
 from datetime import datetime
+from typing import NamedTuple
 
 
-def generate_reports(baroqueproject):
-    data = []
-    # Print out the number of errors and warnings for each validation.
-    for validation, errors in baroqueproject.errors.items():
-        num_requirements = len([error for error in errors if error["error_type"] == "requirement"])
-        num_warnings = len([error for error in errors if error["error_type"] == "warning"])
-        print("SYSTEM REPORT: {} validation has {} requirement error(s) and {} warning error(s)".format(validation, num_requirements, num_warnings))
-        if (num_requirements + num_warnings) > 0:
-            data.extend(errors)
+class ErrorRecord(NamedTuple):
+    """
+    An error kept in memory by MemoryErrorSink, made of the five parts described in BaroqueProject.add_errors.
+    A NamedTuple takes a fraction of the memory of a dictionary with the same five keys.
+    """
+    validation: str
+    error_type: str
+    path: str
+    id: str
+    error: str
+
+
+# Header row values of the csv file.
+fieldnames = list(ErrorRecord._fields)
+
+
+def intern(value):
+    """
+    Intern a string, so that the many errors reported against the same validation, error type, path or id share one copy of it"""
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+def get_report_path(source_directory, destination_directory, extension=".csv"):
+    """
+    Create the report file path with the following structure: destination_directory/directory-YYYYMMDD-HHMMSS.csv."""
+    date = datetime.now().strftime("%Y%m%d-%H%M%S")
+    source = os.path.basename(source_directory)
+    csv_filename = source + "-" + date + extension
+    return os.path.join(destination_directory, csv_filename)
+
+
+class ErrorSink:
+    """
+    Receives the errors found by BaroqueProject and its validators, and counts them by validation and error type.
+    Subclasses decide where the errors themselves go: MemoryErrorSink keeps them until the report is generated,
+    CsvErrorSink writes each one to the error report as soon as it is found, and SummaryErrorSink only counts them.
+    """
+    def __init__(self, source_directory, destination_directory):
+        self.source_directory = source_directory
+        self.destination_directory = destination_directory
+        # Running counts, kept up to date as errors are added so that summaries never go back over the errors themselves
+        # validation -> {"requirement": number of requirement errors, "warning": number of warning errors}
+        self.counts = {}
+        # validation -> item id -> {"requirement": number of requirement errors, "warning": number of warning errors}
+        # Errors that do not belong to an item are counted against their own id
+        self.item_counts = {}
+
+    def register(self, validation):
+        """
+        Register a validation, so that it is reported on even if it finds no errors"""
+        if validation not in self.counts:
+            self.counts[validation] = {"requirement": 0, "warning": 0}
+            self.item_counts[validation] = {}
 
-    if data:
-        # Create the csv file name with the following structure: directory-YYYYMMDD-HHMMSS.csv.
-        date = datetime.now().strftime("%Y%m%d-%H%M%S")
-        source = os.path.basename(baroqueproject.source_directory)
-        csv_filename = source + "-" + date + ".csv"
-        csv_filepath = os.path.join(baroqueproject.destination_directory, csv_filename)
+    def add(self, validation, error_type, path, id, error, item_id=None):
+        """
+        Count and write an error. item_id is the id of the item the error belongs to, if it differs from the error's id"""
+        self.register(validation)
+        self.counts[validation][error_type] += 1
+        if item_id is None:
+            item_id = id
+        item_counts = self.item_counts[validation].get(item_id)
+        if item_counts is None:
+            item_counts = self.item_counts[validation][item_id] = {"requirement": 0, "warning": 0}
+        item_counts[error_type] += 1
+        self.write(validation, error_type, path, id, error)
 
+    def write(self, validation, error_type, path, id, error):
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Finish the error report, returning its path, or None if no errors were found"""
+        raise NotImplementedError
+
+
+class MemoryErrorSink(ErrorSink):
+    """
+    Keeps every error in memory as an ErrorRecord, organized by validation, in the "errors" attribute,
+    and writes them all to the error report once validation is finished.
+    """
+    def __init__(self, source_directory, destination_directory):
+        super().__init__(source_directory, destination_directory)
+        self.errors = {}
+
+    def register(self, validation):
+        super().register(validation)
+        if validation not in self.errors:
+            self.errors[validation] = []
+
+    def write(self, validation, error_type, path, id, error):
+        self.errors[validation].append(ErrorRecord(intern(validation), intern(error_type), intern(path), intern(id), error))
+
+    def close(self):
+        data = []
+        for errors in self.errors.values():
+            data.extend(errors)
+        if not data:
+            return None
+
+        csv_filepath = get_report_path(self.source_directory, self.destination_directory)
         with open(csv_filepath, 'w', newline='', encoding="utf-8") as csvfile:
-            # Define and write header row values of csv file.
-            fieldnames = ['validation', 'error_type', 'path', 'id', 'error']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
+            writer = csv.writer(csvfile)
+            writer.writerow(fieldnames)
             writer.writerows(data)
-        
+        return csv_filepath
+
+
+class CsvErrorSink(ErrorSink):
+    """
+    Writes each error to the error report as soon as it is found, keeping only the number of errors of each validation in memory.
+    The report is created when the first error is found, so no report is written if there are no errors.
+    Errors are written in the order they are found, which is the order of validations unless they run in a ValidationPipeline.
+    """
+    def __init__(self, source_directory, destination_directory):
+        super().__init__(source_directory, destination_directory)
+        # No errors are kept in memory
+        self.errors = {}
+        self.csv_filepath = None
+        self.csvfile = None
+        self.writer = None
+
+    def write(self, validation, error_type, path, id, error):
+        if self.writer is None:
+            self.csv_filepath = get_report_path(self.source_directory, self.destination_directory)
+            self.csvfile = open(self.csv_filepath, 'w', newline='', encoding="utf-8")
+            self.writer = csv.writer(self.csvfile)
+            self.writer.writerow(fieldnames)
+        self.writer.writerow((validation, error_type, path, id, error))
+
+    def close(self):
+        if self.csvfile is not None:
+            self.csvfile.close()
+        return self.csv_filepath
+
+
+class SummaryErrorSink(ErrorSink):
+    """
+    Only counts errors, for runs that only need the summary of each validation. No error report is written.
+    """
+    def __init__(self, source_directory, destination_directory):
+        super().__init__(source_directory, destination_directory)
+        # No errors are kept in memory
+        self.errors = {}
+
+    def write(self, validation, error_type, path, id, error):
+        pass
+
+    def close(self):
+        return None
+
+
+class ColumnarErrorSink(ErrorSink):
+    """
+    Writes errors to a columnar error report with pyarrow, which is an optional dependency, in batches of batch_size errors.
+    The validation, error_type, path and id columns are dictionary-encoded, as the same values repeat across many errors.
+    Each of these columns keeps a dictionary of the distinct values found so far, which each batch is encoded against,
+    so only the distinct values and the current batch are kept in memory.
+    Subclasses set the report's file extension and open a writer for it.
+    """
+    extension = None
+    batch_size = 65536
+    dictionary_fieldnames = ["validation", "error_type", "path", "id"]
+
+    def __init__(self, source_directory, destination_directory):
+        super().__init__(source_directory, destination_directory)
+        try:
+            import pyarrow
+        except ImportError:
+            print("SYSTEM ERROR: pyarrow is required to write {} error reports".format(self.extension))
+            sys.exit()
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            (field, pyarrow.dictionary(pyarrow.int32(), pyarrow.string()) if field in self.dictionary_fieldnames else pyarrow.string())
+            for field in fieldnames
+        ])
+        # No errors are kept in memory, other than the current batch
+        self.errors = {}
+        self.report_path = None
+        self.writer = None
+        self.columns = {field: [] for field in fieldnames}
+        # field -> {value: index of the value in the column's dictionary}
+        self.dictionaries = {field: {} for field in self.dictionary_fieldnames}
+
+    def write(self, validation, error_type, path, id, error):
+        for field, value in zip(fieldnames, (validation, error_type, path, id, error)):
+            if value is not None and type(value) is not str:
+                value = str(value)
+            if field in self.dictionaries:
+                dictionary = self.dictionaries[field]
+                value = dictionary.setdefault(value, len(dictionary))
+            self.columns[field].append(value)
+        if len(self.columns["error"]) >= self.batch_size:
+            self.write_batch()
+
+    def write_batch(self):
+        pyarrow = self.pyarrow
+        arrays = []
+        for field in fieldnames:
+            if field in self.dictionaries:
+                arrays.append(pyarrow.DictionaryArray.from_arrays(
+                    pyarrow.array(self.columns[field], pyarrow.int32()),
+                    pyarrow.array(list(self.dictionaries[field]), pyarrow.string())
+                ))
+            else:
+                arrays.append(pyarrow.array(self.columns[field], pyarrow.string()))
+            self.columns[field] = []
+
+        if self.writer is None:
+            self.report_path = get_report_path(self.source_directory, self.destination_directory, self.extension)
+            self.writer = self.open_writer(self.report_path)
+        self.writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def open_writer(self, report_path):
+        raise NotImplementedError
+
+    def close(self):
+        if self.columns["error"]:
+            self.write_batch()
+        if self.writer is not None:
+            self.writer.close()
+        return self.report_path
+
+
+class ParquetErrorSink(ColumnarErrorSink):
+    """
+    Writes errors to a Parquet error report in batches.
+    """
+    extension = ".parquet"
+
+    def open_writer(self, report_path):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(report_path, self.schema)
+
+
+class ArrowErrorSink(ColumnarErrorSink):
+    """
+    Writes errors to an Arrow IPC file error report in batches.
+    Later batches add the values that are new to each column's dictionary as dictionary deltas.
+    """
+    extension = ".arrow"
+
+    def open_writer(self, report_path):
+        import pyarrow.ipc
+        return pyarrow.ipc.new_file(report_path, self.schema, options=pyarrow.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+
+
+def generate_reports(baroqueproject):
+    # Print out the number of errors and warnings for each validation.
+    for validation, counts in baroqueproject.error_sink.counts.items():
+        print("SYSTEM REPORT: {} validation has {} requirement error(s) and {} warning error(s)".format(validation, counts["requirement"], counts["warning"]))
+
+    csv_filepath = baroqueproject.error_sink.close()
+    if csv_filepath:
         print("SYSTEM ACTIVITY: Detailed error report generated at {}".format(csv_filepath))
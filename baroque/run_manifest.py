@@ -0,0 +1,138 @@
+import hashlib
+import os
+import sqlite3
+
+
+# Bump whenever validation logic changes in a way that makes the errors cached by earlier runs stale.
+MANIFEST_VERSION = 2
+
+
+class RunManifest:
+    """
+    Records, for every item of a run, a signature of its files and metadata and the errors found by each per-item validation.
+    The manifest is kept in a SQLite database in the destination directory, and used again by the next run.
+    Errors are written to the database as they are recorded rather than kept in memory,
+    and only committed by "save", so an interrupted run leaves the manifest of the last complete run behind.
+
+    An item's signature is made of its path, the name, size, modification time and inode of every file in its directory,
+    and its row in the metadata export. In incremental mode, a validation that already ran on an item with the same signature
+    does not run on it again: the errors cached for the item are added to the project instead.
+    Unless use_cache is False, in which case every item is validated again and its errors recorded afresh.
+    When read_only is True, the cached errors are still used, but nothing is recorded or saved.
+
+    Errors are attributed to items by BaroqueProject.get_item_id.
+    """
+
+    filename = "baroque-manifest.sqlite3"
+
+    def __init__(self, destination_directory, items, item_metadata=None, use_cache=True, read_only=False):
+        self.path = os.path.join(destination_directory, self.filename)
+        self.use_cache = use_cache
+        self.read_only = read_only
+        # item id -> item path, for attributing errors to items
+        self.item_keys = {}
+        # Paths of the items whose signature is unchanged since the last run
+        self.unchanged = set()
+        # (validation, item path) pairs for which errors are being recorded in this run
+        self.recording = set()
+
+        # A read-only manifest never creates or changes the manifest in the destination directory,
+        # and uses an empty manifest in memory instead if there is none to read
+        self.connection = sqlite3.connect(self.path if os.path.exists(self.path) or not read_only else ":memory:")
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != MANIFEST_VERSION:
+            if read_only:
+                self.connection.close()
+                self.connection = sqlite3.connect(":memory:")
+            for table in ["items", "validations", "errors"]:
+                self.connection.execute("DROP TABLE IF EXISTS {}".format(table))
+            self.connection.execute("PRAGMA user_version = {}".format(MANIFEST_VERSION))
+        self.connection.execute("CREATE TABLE IF NOT EXISTS items (item TEXT PRIMARY KEY, signature TEXT)")
+        # The validations that ran on each item, so that items without errors can be told apart from items that were never validated
+        self.connection.execute("CREATE TABLE IF NOT EXISTS validations (item TEXT, validation TEXT, PRIMARY KEY (item, validation))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS errors (item TEXT, validation TEXT, error_type TEXT, path TEXT, id TEXT, error TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS errors_by_item ON errors (item, validation)")
+
+        for item in items:
+            key = os.path.abspath(item["path"])
+            metadata = (item_metadata or {}).get(item["id"])
+            signature = (
+                key,
+                tuple(sorted((file, record["size"], record["mtime_ns"], record["inode"]) for file, record in item["file_records"].items())),
+                tuple(metadata) if metadata else None
+            )
+            signature = hashlib.md5(repr(signature).encode("utf-8")).hexdigest()
+
+            # Keep the cached errors of unchanged items, including those of validations that are not run this time
+            row = self.connection.execute("SELECT signature FROM items WHERE item = ?", (key,)).fetchone()
+            if row is not None and row[0] == signature:
+                self.unchanged.add(key)
+            elif not read_only:
+                self._delete(key)
+                self.connection.execute("INSERT INTO items (item, signature) VALUES (?, ?)", (key, signature))
+            self.item_keys[item["id"]] = key
+
+    def _delete(self, key, validation=None):
+        """
+        Delete the errors cached for an item, either for every validation or for only one"""
+        if validation is None:
+            for table in ["items", "validations", "errors"]:
+                self.connection.execute("DELETE FROM {} WHERE item = ?".format(table), (key,))
+        else:
+            self.connection.execute("DELETE FROM errors WHERE item = ? AND validation = ?", (key, validation))
+
+    def has_cached_errors(self, validation, item):
+        """
+        Return whether the errors that validation found for the item in an earlier run can be used,
+        which is not the case if the cache is not used, the item changed since, or the validation never ran on it"""
+        key = os.path.abspath(item["path"])
+        if not self.use_cache or key not in self.unchanged:
+            return False
+        return self.connection.execute("SELECT 1 FROM validations WHERE item = ? AND validation = ?", (key, validation)).fetchone() is not None
+
+    def get_cached_errors(self, validation, item):
+        """
+        Return the errors that validation found for the item in an earlier run, in the order they were found,
+        or None if they cannot be used (see "has_cached_errors")"""
+        if not self.has_cached_errors(validation, item):
+            return None
+        key = os.path.abspath(item["path"])
+        return self.connection.execute(
+            "SELECT error_type, path, id, error FROM errors WHERE item = ? AND validation = ? ORDER BY rowid", (key, validation)
+        ).fetchall()
+
+    def start(self, validation, item):
+        """
+        Start recording the errors that validation finds for the item, replacing any errors cached for it"""
+        if self.read_only:
+            return
+        key = os.path.abspath(item["path"])
+        self._delete(key, validation)
+        self.connection.execute("INSERT OR IGNORE INTO validations (item, validation) VALUES (?, ?)", (key, validation))
+        self.recording.add((validation, key))
+
+    def record(self, validation, error_type, path, id, error, item_id=None):
+        """
+        Record an error against the item it belongs to (by default, the item with the error's id),
+        if errors for that item and validation are being recorded"""
+        key = self.item_keys.get(id if item_id is None else item_id)
+        if (validation, key) in self.recording:
+            self.connection.execute(
+                "INSERT INTO errors (item, validation, error_type, path, id, error) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, validation, error_type, path, id, error)
+            )
+
+    def save(self):
+        """
+        Commit the errors recorded in this run to the manifest, dropping items that are no longer part of the run,
+        and close the manifest, which cannot be used after"""
+        try:
+            if not self.read_only:
+                current_keys = set(self.item_keys.values())
+                for key, in self.connection.execute("SELECT item FROM items").fetchall():
+                    if key not in current_keys:
+                        self._delete(key)
+                self.connection.commit()
+        except sqlite3.Error:
+            print("SYSTEM ERROR: run manifest could not be written to destination_directory")
+        finally:
+            self.connection.close()
@@ -1,15 +1,30 @@
 import os
-import re
 import sys
 from tqdm import tqdm
 
+from .baroque_project import PART_FILE_FORMATS
 from .baroque_validator import BaroqueValidator
 
 
 # structure_validation.py runs "validate_structure", which calls for "validate_directory" and "validate_file"
-# "validate_directory" uses "parse_baroqueproject", "parse_metadata_export", "compare_ids", and "check_empty_directory"
+# "validate_directory" uses the project's id indexes ("collections_by_id", "items_by_id"), the metadata export, and "check_empty_directory"
 # "validate_file" uses "check_item_files" and "check_intellectual_groups"
-# "check_item_files" uses "check_empty_file" and "check_intellectual_groups" uses "create_intellectual_groups"
+# "check_item_files" uses "check_empty_file" and "check_intellectual_groups" uses the project's "get_intellectual_groups"
+# None of these go back to the file system: they read the directory entries and file records captured by BaroqueProject
+# Messages for malformed digital parts, for parts with exactly 6 files (True) and parts with more or less than 6 files (False)
+part_file_messages = {
+    True: {
+        "extra": "digital part has 6 total files, but has {extra} extra '{format}' file(s)",
+        "missing": "digital part has 6 total files, but is missing 1 '{format}' file",
+        "other": "digital part has 6 files, but has {count} other file(s): {files}"
+    },
+    False: {
+        "extra": "digital part has {total} total files, including {extra} extra '{format}' file(s)",
+        "missing": "digital part has {total} total files and is missing 1 '{format}' file",
+        "other": "digital part has {total} total files, including {count} other file(s): {files}"
+    }
+}
+
 
 class StructureValidator(BaroqueValidator):
     def __init__(self, project):
@@ -18,30 +33,21 @@ class StructureValidator(BaroqueValidator):
         super().__init__(validation, validator, project)
 
 
-    def parse_baroqueproject(self, level):
-        ids = []
-        paths = []
-
-        for a in getattr(self.project, level):
-            ids.append(a["id"])
-            paths.append(a["path"])
-
-        return ids, paths
-
+    def check_empty_directory(self, directory):
+        if directory["num_entries"] == 0:
+            self.error(directory["path"], os.path.basename(directory["path"]), "empty directory")
 
-    def check_empty_directory(self, directory_path):
-        if len(os.listdir(directory_path)) == 0:
-            self.error(directory_path, os.path.basename(directory_path), "empty directory")
 
-
-    def check_empty_file(self, file_path):
-        for dirpath, dirnames, filenames in os.walk(file_path):
-            for filename in filenames:
-                if ".txt" not in filename:
-                    file_path = os.path.join(dirpath, filename)
-                    file_size = os.path.getsize(file_path)
-                    if file_size == 0:
-                        self.error(file_path, os.path.basename(file_path), "empty file")
+    def check_empty_file(self, item):
+        for filename, file_record in item["file_records"].items():
+            if ".txt" not in filename and not file_record["is_dir"]:
+                if file_record["size"] == 0:
+                    file_path = os.path.join(item["path"], filename)
+                    self.error(file_path, os.path.basename(file_path), "empty file")
+        # Files in the item's subdirectories, which are reported after the item's own files
+        for file_path, file_size in item["nested_file_sizes"].items():
+            if ".txt" not in os.path.basename(file_path) and file_size == 0:
+                self.error(file_path, os.path.basename(file_path), "empty file")
 
 
     def validate_directory(self, level):
@@ -52,20 +58,21 @@ class StructureValidator(BaroqueValidator):
         create two ID lists, cross-compare the two ID lists, and print any ID that does not exists NOT in BOTH lists.
         It also checks for any empty directory.
         """
-        process_ids, process_paths = self.parse_baroqueproject(level)
-        export_ids = self.project.metadata["{}_ids".format(level)]
+        process_ids = getattr(self.project, "{}_by_id".format(level))
+        if level == "collections":
+            export_ids = self.project.metadata["collections_ids"]
+        else:
+            export_ids = self.project.metadata["item_metadata"]
 
-        diff_process_ids = list(set(process_ids) - set(export_ids))
-        diff_export_ids = list(set(export_ids) - set(process_ids))
+        # Both sides are dictionaries, so each lookup is O(1) and ids are reported in the order they were found.
+        diff_process_ids = [id for id in process_ids if id not in export_ids]
+        diff_export_ids = [id for id in export_ids if id not in process_ids]
 
         # Report ids that do not exist in the metadata export as errors.
         if len(diff_process_ids) != 0:
             for id in diff_process_ids:
-                for tuple_id, tuple_path in tuple(zip(process_ids, process_paths)):
-                    if id == tuple_id:
-                        path = tuple_path
                 self.error(
-                    path,
+                    process_ids[id]["path"],
                     id,
                     level[:-1] + " id does not exist in metadata export"
                 )
@@ -80,8 +87,8 @@ class StructureValidator(BaroqueValidator):
                 )
 
         # Check for any empty directory.
-        for path in process_paths:
-            self.check_empty_directory(path)
+        for directory in getattr(self.project, level):
+            self.check_empty_directory(directory)
 
 
     def check_item_files(self):
@@ -177,55 +184,18 @@ class StructureValidator(BaroqueValidator):
                             "file name does not start with item id: '{}'".format(file)
                         )
 
-            self.check_empty_file(item["path"])
-
-
-    def create_intellectual_groups(self):
-        """
-        Create intellectual groups of md5, mp3, and wav files, which make up a digital part.
-        Return a dictionary with the following format:
-            {
-                item id (e.g., 85429-SR-1) :
-                {
-                    part id (e.g., 85429-SR-1-1) : [part files (e.g., 85429-SR-1-1-am.wav)]
-                }
-            }
-        """
-        part_file_types = ["md5", "mp3", "wav"]
-        part_name_regex = re.compile(r"\d+\-SR-\d+(\-\d+){1,}")
-        items = {}
-
-        for item in self.project.items:
-            for file_type, files in item["files"].items():
-                if file_type in part_file_types:
-                    for file in files:
-
-                        # Isolate file names without extensions (e.g., "-am.wav").
-                        name_match = part_name_regex.match(file)
-                        if name_match:
-                            name = name_match.group()
-
-                            # Create dictionary of intellectual groups
-                            if item["id"] not in items.keys():
-                                items[item["id"]] = {}
-                            if name not in items[item["id"]].keys():
-                                items[item["id"]][name] = []
-                            items[item["id"]][name].append(file)
-
-        return items
+            self.check_empty_file(item)
 
 
     def check_intellectual_groups_numbers(self):
             """
             Make sure that intellectual groups are well-formed by checking that each part number is consecutively numbered.
             """
-            items = self.create_intellectual_groups()
+            items = self.project.get_intellectual_groups()
 
             for item in items.keys():
                 # Find each item's path, which is needed for error reporting.
-                for item_dict in self.project.items:
-                    if item_dict["id"] == item:
-                        path = item_dict["path"]
+                path = self.project.items_by_id[item]["path"]
 
                 # Check that each of the part numbers is consecutive
                 part_ids = []
@@ -257,95 +227,45 @@ class StructureValidator(BaroqueValidator):
         (2) Checking that each part has exactly one of the 6 required file formats.
         Report any exceptions (e.g., more than 6 files, missing required files) as errors.
         """
-        items = self.create_intellectual_groups()
+        items = self.project.get_intellectual_groups()
+        # A well-formed digital part has exactly one file of each format, and no other files.
+        expected_counts = [1] * len(PART_FILE_FORMATS)
 
         for item in items.keys():
             # Find each item's path, which is needed for error reporting.
-            for item_dict in self.project.items:
-                if item_dict["id"] == item:
-                    path = item_dict["path"]
-
-            for part in items[item]:
-                count_formats = {"-am.wav": 0, "-am.wav.md5": 0, "-pm.wav": 0, "-pm.wav.md5": 0, ".mp3": 0, ".mp3.md5": 0, "other":[]}
-
-                # If the digital part does not have exactly 6 files, identify extra or missing required file extensions in count_formats.
-                # Also identify any files that do not end with the extensions listed in count_formats.
-                if len(items[item][part]) != 6:
-                    # Count the number of times each extension (e.g., -am.wav) occurs in the digital part.
-                    for file in items[item][part]:
-                        other = True
-                        for format in count_formats.keys():
-                            if file.endswith(format):
-                                count_formats[format] += 1
-                                other = False
-                                break
-                        if other == True:
-                            count_formats["other"].append(file)
-
-                    for format in count_formats.keys():
-                        # For each digital part with more than 6 files, report any other file extensions as errors.
-                        if format == "other":
-                            if len(count_formats["other"]) > 0:
-                                self.error(
-                                    os.path.join(path, part),
-                                    part,
-                                    "digital part has {} total files, including {} other file(s): {}". format(len(items[item][part]), len(count_formats["other"]), count_formats["other"])
-                                )
-                        else:
-                            # For each digital part with more than 6 files, report any extra file extensions as errors.
-                            if count_formats[format] > 1:
-                                self.error(
-                                    os.path.join(path, part),
-                                    part,
-                                     "digital part has {} total files, including {} extra '{}' file(s)". format(len(items[item][part]), count_formats[format] - 1, format)
-                                )
-                            # For each digital part with more than 6 files, report any missing file extensions as errors.
-                            if count_formats[format] < 1:
-                                self.error(
-                                    os.path.join(path, part),
-                                    part,
-                                    "digital part has {} total files and is missing 1 '{}' file". format(len(items[item][part]), format)
-                                )
-
-                # Check that a digital part with 6 files has one and only one of each of the required file extensions in count_formats.
-                # Also identify any files that do not end with the extensions listed in count_formats.
-                if len(items[item][part]) == 6:
-                    # Count the number of times each extension (e.g., -am.wav) occurs in the digital part.
-                    for file in items[item][part]:
-                        other = True
-                        for format in count_formats.keys():
-                            if file.endswith(format):
-                                count_formats[format] += 1
-                                other = False
-                                break
-                        if other == True:
-                            count_formats["other"].append(file)
-
-                    for format in count_formats.keys():
-                        # For each digital part with 6 files, report any other file extensions as errors.
-                        if format == "other":
-                            if len(count_formats["other"]) > 0:
-                                self.error(
-                                    os.path.join(path, part),
-                                    part,
-                                    "digital part has 6 files, but has {} other file(s): {}". format(len(items[item][part]), len(count_formats["other"]), count_formats["other"])
-                                )
-                        else:
-                            # For each digital part with 6 files, report any extra file extensions as errors.
-                            if count_formats[format] > 1:
-                                extra = count_formats[format] - 1
-                                self.error(
-                                    os.path.join(path, part),
-                                    part,
-                                    "digital part has 6 total files, but has {} extra '{}' file(s)".format(extra, format)
-                                )
-                            # For each digital part with 6 files, report any missing file extensions as errors.
-                            if count_formats[format] < 1:
-                                self.error(
-                                    os.path.join(path, part),
-                                    part,
-                                    "digital part has 6 total files, but is missing 1 '{}' file".format(format)
-                                )
+            path = self.project.items_by_id[item]["path"]
+
+            for part_id, part in items[item].items():
+                if part.counts == expected_counts and not part.other:
+                    continue
+
+                # Digital parts with exactly 6 files and digital parts with more or less than 6 files are reported with different messages.
+                total = len(part.files)
+                messages = part_file_messages[total == len(PART_FILE_FORMATS)]
+
+                for format, count in zip(PART_FILE_FORMATS, part.counts):
+                    # For each digital part, report any extra file extensions as errors.
+                    if count > 1:
+                        self.error(
+                            os.path.join(path, part_id),
+                            part_id,
+                            messages["extra"].format(total=total, extra=count - 1, format=format)
+                        )
+                    # For each digital part, report any missing file extensions as errors.
+                    if count < 1:
+                        self.error(
+                            os.path.join(path, part_id),
+                            part_id,
+                            messages["missing"].format(total=total, format=format)
+                        )
+
+                # For each digital part, report any other file extensions as errors.
+                if part.other:
+                    self.error(
+                        os.path.join(path, part_id),
+                        part_id,
+                        messages["other"].format(total=total, count=len(part.other), files=part.other)
+                    )
 
     def validate_file(self):
         self.check_item_files()
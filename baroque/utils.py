@@ -1,19 +1,71 @@
+import datetime
+import functools
+import hashlib
 import re
 
 
+# sanitize_text collapses whitespace, then removes quotes, apostrophes, hyphens, semicolons and ellipses and spells out ampersands.
+# Removing characters with one character class is faster than str.translate, which falls back to a slow path for dictionary tables.
+whitespace_regex = re.compile(r"\s+")
+removed_characters_regex = re.compile(r"[“”\"';…-]")
+
+
+@functools.lru_cache(maxsize=4096)
 def sanitize_text(text):
     """
-    Helper function to remove newlines and extra spaces from a string"""
+    Helper function to remove newlines and extra spaces from a string
+    Results are cached, as the same expected values (e.g., "University of Michigan, Bentley Historical Library") are sanitized for every item"""
     if text is None:
         return ""
     else:
-        text = re.sub(r"\n", " ", text)
-        text = re.sub(r"\s+", " ", text)
-        text = text.replace('“', '"').replace('”', '"').replace('"', "")
-        text = text.replace("'", "")
-        text = text.replace("-", "")
-        text = text.replace(";", "")
-        text = text.replace("…", "")
-        text = text.replace ("&", "and")
-        text = text.strip()
-        return text
+        text = whitespace_regex.sub(" ", text)
+        return removed_characters_regex.sub("", text).replace("&", "and").strip()
+
+
+iso_date_regex = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+iso_time_regex = re.compile(r"^(\d{2}):(\d{2}):(\d{2})$")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_date(text):
+    """
+    Parse a date or time string into a datetime, returning None if it cannot be parsed.
+    ISO 8601 dates (YYYY-MM-DD) and times (HH:MM:SS), as found in METS and BEXT chunks, are parsed directly;
+    anything else, such as the free-text dates in the metadata export, falls back to dateparser.
+    Results are cached, as the same dates and times recur across the items and WAV files of a shipment."""
+    try:
+        match = iso_date_regex.match(text)
+        if match:
+            return datetime.datetime(*map(int, match.groups()))
+        match = iso_time_regex.match(text)
+        if match:
+            # Like dateparser, times without a date are taken to be today
+            return datetime.datetime.combine(datetime.date.today(), datetime.time(*map(int, match.groups())))
+    except ValueError:
+        # Out of range values such as 2019-02-29 are left to dateparser, which does not parse them either
+        pass
+
+    # dateparser takes a noticeable fraction of a second to import, so it is only imported once a date needs it
+    import dateparser
+    return dateparser.parse(text)
+
+
+# Files are hashed in fixed-size blocks read into a reusable buffer, so memory use does not depend on file size.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def md5_checksum(path, buffer=None):
+    """
+    Stream a file through MD5 in CHUNK_SIZE blocks and return its hex digest.
+    An existing bytearray can be passed as buffer to avoid allocating a new one for every file."""
+    if buffer is None:
+        buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    md5 = hashlib.md5()
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            md5.update(view[:size])
+    return md5.hexdigest()
@@ -1,51 +1,51 @@
-import configparser
-import csv
-import dateparser
 import os
-import subprocess
-import io
-from tqdm import tqdm
 
-from .baroque_validator import BaroqueValidator
-from .utils import sanitize_text
+from .baroque_validator import BaroqueValidator, ValidationContext
+from .bext_chunk_reader import read_bext_chunk, WavChunkError
+from .utils import normalize_date, sanitize_text
 
 
-class WavBextChunkValidator(BaroqueValidator):
-    def __init__(self, project):
-        validation = "wav_bext_chunk"
-        validator = self.validate_wav_bext_chunks
-        super().__init__(validation, validator, project)
-    
-    def get_paths_to_wavs(self, item):
-        self.item_id = item["id"]
-        self.path_to_item = item["path"]
-        self.item_metadata = self.project.metadata["item_metadata"].get(self.item_id)
-        paths_to_wavs = []
-        path_to_item = item['path']
-        wav_files = item['files']['wav']
-        for wav_file in wav_files:
-            paths_to_wavs.append(os.path.join(path_to_item, wav_file))
-        
-        return paths_to_wavs
+class WavBextChunk(ValidationContext):
+    """
+    Validates the BEXT chunk of a single WAV file, collecting errors rather than adding them to a BaroqueProject
+    so that WAV files can be validated in worker processes.
+    """
+    def __init__(self, item_id, item_metadata):
+        super().__init__()
+        self.item_id = item_id
+        self.item_metadata = item_metadata
 
-    def get_bwfmetaedit_csv(self, path_to_wav):
+    def get_bext_chunk(self, path_to_wav):
         """
-        Uses Windows 64-bit BWF MetaEdit CLI to get BEXT CSV
-
-        Example CSV:
-        
-        FileName,Description,Originator,OriginatorReference,OriginationDate,OriginationTime,TimeReference (translated),TimeReference,BextVersion,UMID,LoudnessValue,LoudnessRange,MaxTruePeakLevel,MaxMomentaryLoudness,MaxShortTermLoudness,CodingHistory,IARL,IART,ICMS,ICMT,ICOP,ICRD,IENG,IGNR,IKEY,IMED,INAM,IPRD,ISBJ,ISFT,ISRC,ISRF,ITCH
-        R:\\BAroQUe\\2019012\\0648\\0648-SR-4\\0648-SR-4-1-2-am.wav,Paul Phillips (Tape No. 4),"US, MiU-H",MiU-H_0648-SR-4-1-am,2019-05-20,12:04:58,00:47:59.000,276384000,1,,,,,,,"A=ANALOGUE,M=mono,T=Studer A-810; 7.5 ips; open reel
-A=PCM,F=96000,W=24,M=mono,T=Antelope Audio;Orion 32;A/D",,,,,,,"Schreibeis, Ryan",,,,,,,,,Reel-to-reel; 7 inch; Sony; None; Polyester"""
+        Reads the WAV BEXT and LIST/INFO chunks into a dictionary keyed like BWF MetaEdit's "--out-core" CSV
+
+        Example:
+
+        {
+            "FileName": "R:\\BAroQUe\\2019012\\0648\\0648-SR-4\\0648-SR-4-1-2-am.wav",
+            "Description": "Paul Phillips (Tape No. 4)",
+            "Originator": "US, MiU-H",
+            "OriginatorReference": "MiU-H_0648-SR-4-1-am",
+            "OriginationDate": "2019-05-20",
+            "OriginationTime": "12:04:58",
+            "TimeReference (translated)": "00:47:59.000",
+            "TimeReference": "276384000",
+            "CodingHistory": "A=ANALOGUE,M=mono,T=Studer A-810; 7.5 ips; open reel
+A=PCM,F=96000,W=24,M=mono,T=Antelope Audio;Orion 32;A/D",
+            "IENG": "Schreibeis, Ryan",
+            "ISRF": "Reel-to-reel; 7 inch; Sony; None; Polyester",
+            ...
+        }"""
 
         try:
-            config = configparser.ConfigParser()
-            config.read(os.path.join(".", "config.ini"))
-            bwfmetaedit_csv = subprocess.check_output([os.path.join(".", config["bwf_metaedit"]["path"]), "--out-core", path_to_wav], stderr=subprocess.STDOUT)
-        except: 
-            bwfmetaedit_csv = subprocess.check_output(["./tools/bwfmetaedit.exe", "--out-core", path_to_wav], stderr=subprocess.STDOUT)
-
-        return bwfmetaedit_csv
+            return read_bext_chunk(path_to_wav)
+        except (OSError, WavChunkError):
+            self.error(
+                path_to_wav,
+                self.item_id,
+                "wav file is not valid"
+            )
+            return None
 
     def check_bext_metadatum_exists(self, path_to_wav, row, metadatum):
         """
@@ -72,7 +72,7 @@ A=PCM,F=96000,W=24,M=mono,T=Antelope Audio;Orion 32;A/D",,,,,,,"Schreibeis, Ryan
         """
         Helper function to see if WAV BEXT chunk metadata element value looks like a date or time"""
         self.check_bext_metadatum_exists(path_to_wav, row, metadatum)
-        if row.get(metadatum) and not dateparser.parse(row[metadatum]):
+        if row.get(metadatum) and not normalize_date(row[metadatum]):
             self.error(
                 path_to_wav,
                 self.item_id,
@@ -160,42 +160,95 @@ A=PCM,F=96000,W=24,M=mono,T=Antelope Audio;Orion 32;A/D",,,,,,,"Schreibeis, Ryan
             self.check_num_coding_history_subelement_is_at_least_one(path_to_wav, coding_histories, "T")
 
     
-    def validate_bwfmetaedit_csv(self, path_to_wav, bwfmetaedit_csv):
+    def validate_bext_chunk(self, path_to_wav, row):
         """
-        Validates BWF Metedit WAV BEXT chunk CSV"""
-
-        with io.StringIO(bwfmetaedit_csv.decode("utf-8")) as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if self.item_metadata:
-                    item_title = self.item_metadata.get("item_title")
-                    self.check_bext_metadatum_value_is(path_to_wav, row, "Description", item_title)
-                else:
-                    self.warn(
-                        path_to_wav,
-                        self.item_id,
-                        "item has no associated metadata in the metadata export spreadsheet to validate against wav bext chunk"
-                    )
-                    self.check_bext_metadatum_exists(path_to_wav, row, "Description")
+        Validates WAV BEXT chunk"""
+
+        if self.item_metadata:
+            item_title = self.item_metadata.item_title
+            self.check_bext_metadatum_value_is(path_to_wav, row, "Description", item_title)
+        else:
+            self.warn(
+                path_to_wav,
+                self.item_id,
+                "item has no associated metadata in the metadata export spreadsheet to validate against wav bext chunk"
+            )
+            self.check_bext_metadatum_exists(path_to_wav, row, "Description")
+
+        self.check_bext_metadatum_value_is(path_to_wav, row, "Originator", "US, MiU-H")
+        originator_reference = "MiU-H_" + os.path.splitext(os.path.split(path_to_wav)[1])[0]
+        self.check_bext_metadatum_value_is(path_to_wav, row, "OriginatorReference", originator_reference)
+
+        self.check_bext_metadatum_value_is_datetime(path_to_wav, row, "OriginationDate")
+        self.check_bext_metadatum_value_is_datetime(path_to_wav, row, "OriginationTime")
+
+        self.check_bext_metadatum_exists(path_to_wav, row, "TimeReference")
+
+        self.check_coding_history_subelements(path_to_wav, row)
 
-                self.check_bext_metadatum_value_is(path_to_wav, row, "Originator", "US, MiU-H")
-                originator_reference = "MiU-H_" + os.path.splitext(os.path.split(path_to_wav)[1])[0]
-                self.check_bext_metadatum_value_is(path_to_wav, row, "OriginatorReference", originator_reference)
 
-                self.check_bext_metadatum_value_is_datetime(path_to_wav, row, "OriginationDate")
-                self.check_bext_metadatum_value_is_datetime(path_to_wav, row, "OriginationTime")
+def validate_wav_bext_chunk(task):
+    """
+    Validates the BEXT chunk of one WAV file and returns the errors found.
+    Takes a single (path_to_wav, item_id, item_metadata) task so it can be used with WavBextChunkValidator.map"""
+    path_to_wav, item_id, item_metadata = task
+    wav = WavBextChunk(item_id, item_metadata)
+    bext_chunk = wav.get_bext_chunk(path_to_wav)
+    if bext_chunk is not None:
+        wav.validate_bext_chunk(path_to_wav, bext_chunk)
+    return wav.errors
 
-                self.check_bext_metadatum_exists(path_to_wav, row, "TimeReference")
 
-                self.check_coding_history_subelements(path_to_wav, row)
+def validate_item_wav_bext_chunks(task):
+    """
+    Validates the BEXT chunks of every WAV file of one item and returns the errors found.
+    Takes a single (paths_to_wavs, item_id, item_metadata) task so it can be used in a ValidationPipeline"""
+    paths_to_wavs, item_id, item_metadata = task
+    errors = []
+    for path_to_wav in paths_to_wavs:
+        errors.extend(validate_wav_bext_chunk((path_to_wav, item_id, item_metadata)))
+    return errors
 
 
+class WavBextChunkValidator(BaroqueValidator):
+    item_validator = staticmethod(validate_item_wav_bext_chunks)
+
+    def __init__(self, project, jobs=1):
+        validation = "wav_bext_chunk"
+        validator = self.validate_wav_bext_chunks
+        super().__init__(validation, validator, project, jobs)
+
+    def get_paths_to_wavs(self, item):
+        paths_to_wavs = []
+        path_to_item = item['path']
+        wav_files = item['files']['wav']
+        for wav_file in wav_files:
+            paths_to_wavs.append(os.path.join(path_to_item, wav_file))
+        
+        return paths_to_wavs
+
+    def get_item_task(self, item):
+        """
+        Returns the task to run "validate_item_wav_bext_chunks" on for an item"""
+        return self.get_paths_to_wavs(item), item["id"], self.project.metadata["item_metadata"].get(item["id"])
+
     def validate_wav_bext_chunks(self):
         """ 
-        Validates WAV BEXT chunks """
-
-        for item in tqdm(self.project.items, desc="WAV BEXT Chunk Validation"):
-            paths_to_wavs = self.get_paths_to_wavs(item)
-            for path_to_wav in paths_to_wavs: 
-                bwfmetaedit_csv = self.get_bwfmetaedit_csv(path_to_wav)
-                self.validate_bwfmetaedit_csv(path_to_wav, bwfmetaedit_csv)
+        Validates WAV BEXT chunks, spreading WAV files across self.jobs worker processes """
+
+        items = self.get_items_to_validate()
+        tasks = []
+        for item, cached in items:
+            if not cached:
+                item_metadata = self.project.metadata["item_metadata"].get(item["id"])
+                for path_to_wav in self.get_paths_to_wavs(item):
+                    tasks.append((path_to_wav, item["id"], item_metadata))
+        results = self.map(validate_wav_bext_chunk, tasks, desc="WAV BEXT Chunk Validation")
+
+        def get_item_errors():
+            # Join the errors of each item's WAV files, which are validated one file per task
+            for item, cached in items:
+                if not cached:
+                    yield [error for path_to_wav in item["files"]["wav"] for error in next(results)]
+
+        self.add_item_results(items, get_item_errors())
@@ -0,0 +1,57 @@
+"""
+Measures how long baroque.py spends importing modules, using "python -X importtime".
+
+Runs baroque.py with the given arguments (by default, just "--help"), prints the slowest top-level imports,
+and exits with status 1 if the total import time is over the budget.
+
+    $ python benchmarks/import_time.py --budget 100
+    $ python benchmarks/import_time.py --budget 250 -- SOURCE_DIR -c
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+BAROQUE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "baroque.py")
+
+
+def measure_imports(baroque_args):
+    """
+    Runs baroque.py under "python -X importtime" and returns a list of (module, cumulative microseconds) tuples for top-level imports"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", BAROQUE] + baroque_args,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        # Nested imports are indented, and their time is already included in their top-level import's cumulative time
+        if not module.startswith("  "):
+            imports.append((module.strip(), int(cumulative)))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--budget", type=float, default=100, help="Import time budget in milliseconds")
+    parser.add_argument("-t", "--top", type=int, default=10, help="Number of slowest imports to list")
+    parser.add_argument("baroque_args", nargs="*", help="Arguments to run baroque.py with (defaults to --help)")
+    args = parser.parse_args()
+
+    imports = measure_imports(args.baroque_args or ["--help"])
+    total = sum(cumulative for _, cumulative in imports) / 1000
+
+    for module, cumulative in sorted(imports, key=lambda module_import: module_import[1], reverse=True)[:args.top]:
+        print("{:10.1f} ms  {}".format(cumulative / 1000, module))
+    print("{:10.1f} ms  total (budget {:.0f} ms)".format(total, args.budget))
+
+    if total > args.budget:
+        print("SYSTEM ERROR: import time is over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Micro-benchmark for the METS path lookups done by MetsItem for every item.
+
+Writes a corpus of METS files to a temporary directory, parses each of them once,
+and then times the lookups that the METS validation does on every item two ways:
+with string paths and namespace dictionaries (tree.xpath, Element.find and Element.findall),
+and with the XPath expressions compiled by "compile_path".
+
+    $ python benchmarks/mets_paths.py -n 10000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from baroque.mets_validation import compile_path, find_first, get_parser, namespaces
+
+
+SECTIONS = ["/mets:mets", "/mets:mets/mets:metsHdr", "/mets:mets/mets:dmdSec", "/mets:mets/mets:amdSec", "/mets:mets/mets:fileSec", "/mets:mets/mets:structMap"]
+DC_ELEMENTS = ["dc:title", "dc:relation", "dc:identifier", "dc:date", "dc:format"]
+
+
+def make_mets(item_id, parts):
+    files = []
+    for part in range(1, parts + 1):
+        files += ["{}-{}-am.wav".format(item_id, part), "{}-{}-pm.wav".format(item_id, part), "{}-{}.mp3".format(item_id, part)]
+    agents = "".join(
+        '<mets:agent ROLE="{}" TYPE="ORGANIZATION"><mets:name>University of Michigan, Bentley Historical Library</mets:name></mets:agent>'.format(role)
+        for role in ["OTHER", "PRESERVATION", "DISSEMINATOR"]
+    )
+    tech_mds = "".join(
+        '<mets:techMD ID="t{}"><mets:mdWrap MDTYPE="OTHER"><mets:xmlData><aes:audioObject>'
+        '<aes:primaryIdentifier>{}</aes:primaryIdentifier></aes:audioObject></mets:xmlData></mets:mdWrap></mets:techMD>'.format(n, file)
+        for n, file in enumerate(files)
+    )
+    divs = "".join('<mets:div><mets:fptr FILEID="mdp.{}"/></mets:div>'.format(file) for file in files)
+    return (
+        '<mets:mets xmlns:mets="{mets}" xmlns:dc="{dc}" xmlns:aes="{aes}" OBJID="{id}" TYPE="AUDIO RECORDING">'
+        '<mets:metsHdr CREATEDATE="2019-08-05T11:47:37">{agents}</mets:metsHdr>'
+        '<mets:dmdSec><mets:mdWrap MDTYPE="DC"><mets:xmlData><dc:title>Title</dc:title><dc:relation>Collection</dc:relation>'
+        '<dc:identifier>{id}</dc:identifier><dc:date>2019-05-20</dc:date><dc:format>audio</dc:format></mets:xmlData></mets:mdWrap></mets:dmdSec>'
+        '<mets:amdSec>{tech_mds}<mets:sourceMD/><mets:digiprovMD/></mets:amdSec>'
+        '<mets:fileSec><mets:fileGrp ID="audio-files"/><mets:fileGrp ID="media_images"/></mets:fileSec>'
+        '<mets:structMap><mets:div>{divs}</mets:div></mets:structMap></mets:mets>'
+    ).format(id=item_id, agents=agents, tech_mds=tech_mds, divs=divs, **namespaces)
+
+
+def string_lookups(tree):
+    sections = [tree.xpath(section, namespaces=namespaces) for section in SECTIONS]
+    mets_header, dmd_sec, amd_sec, file_sec, struct_map = [elements[0] for elements in sections[1:]]
+    for agent in mets_header.findall("mets:agent", namespaces=namespaces):
+        agent.find("mets:name", namespaces=namespaces)
+    xml_data = dmd_sec.find("mets:mdWrap", namespaces=namespaces).find("mets:xmlData", namespaces=namespaces)
+    for dc_element in DC_ELEMENTS:
+        xml_data.find(dc_element, namespaces=namespaces)
+    for tech_md in amd_sec.findall("mets:techMD", namespaces=namespaces):
+        tech_md.find("mets:mdRef", namespaces=namespaces)
+        tech_md.find("./mets:mdWrap/mets:xmlData/aes:audioObject/aes:primaryIdentifier", namespaces=namespaces)
+    file_sec.findall("mets:fileGrp", namespaces=namespaces)
+    for div in struct_map.find("mets:div", namespaces=namespaces).findall("mets:div", namespaces=namespaces):
+        div.findall("mets:fptr", namespaces=namespaces)
+
+
+def compiled_lookups(tree):
+    sections = [compile_path(section)(tree) for section in SECTIONS]
+    mets_header, dmd_sec, amd_sec, file_sec, struct_map = [elements[0] for elements in sections[1:]]
+    for agent in compile_path("mets:agent")(mets_header):
+        find_first(agent, "mets:name")
+    xml_data = find_first(find_first(dmd_sec, "mets:mdWrap"), "mets:xmlData")
+    for dc_element in DC_ELEMENTS:
+        find_first(xml_data, dc_element)
+    for tech_md in compile_path("mets:techMD")(amd_sec):
+        find_first(tech_md, "mets:mdRef")
+        find_first(tech_md, "./mets:mdWrap/mets:xmlData/aes:audioObject/aes:primaryIdentifier")
+    compile_path("mets:fileGrp")(file_sec)
+    for div in compile_path("mets:div")(find_first(struct_map, "mets:div")):
+        compile_path("mets:fptr")(div)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=10000, help="Number of METS files in the corpus")
+    parser.add_argument("-p", "--parts", type=int, default=4, help="Number of digital parts described by each METS file")
+    args = parser.parse_args()
+
+    corpus_dir = tempfile.mkdtemp()
+    try:
+        paths = []
+        for n in range(args.number):
+            path = os.path.join(corpus_dir, "0648-SR-{}.xml".format(n))
+            with open(path, "w") as f:
+                f.write(make_mets("0648-SR-{}".format(n), args.parts))
+            paths.append(path)
+
+        start = time.perf_counter()
+        trees = [etree.parse(path, get_parser()) for path in paths]
+        parsing = time.perf_counter() - start
+
+        timings = {}
+        for name, lookups in [("string paths", string_lookups), ("compiled paths", compiled_lookups)]:
+            start = time.perf_counter()
+            for tree in trees:
+                lookups(tree)
+            timings[name] = time.perf_counter() - start
+
+        print("{} METS files with {} digital parts each".format(args.number, args.parts))
+        print("parsing:        {:8.1f} us/item".format(parsing / args.number * 1e6))
+        for name, seconds in timings.items():
+            print("{:15} {:8.1f} us/item".format(name + ":", seconds / args.number * 1e6))
+        print("speedup:        {:8.2f}x".format(timings["string paths"] / timings["compiled paths"]))
+    finally:
+        shutil.rmtree(corpus_dir)
+
+
+if __name__ == "__main__":
+    main()
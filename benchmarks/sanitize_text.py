@@ -0,0 +1,91 @@
+"""
+Benchmarks baroque.utils.sanitize_text against the implementation it replaced,
+which ran two re.sub calls and a chain of str.replace calls on every string.
+
+Builds a corpus like the strings sanitized while validating a shipment (expected values that recur for every item,
+and titles and coding histories that differ between items), checks that both implementations agree on every string,
+and times sanitizing the corpus with each.
+
+    $ python benchmarks/sanitize_text.py -n 100000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from baroque.utils import sanitize_text
+
+
+def replace_sanitize_text(text):
+    if text is None:
+        return ""
+    else:
+        text = re.sub(r"\n", " ", text)
+        text = re.sub(r"\s+", " ", text)
+        text = text.replace('“', '"').replace('”', '"').replace('"', "")
+        text = text.replace("'", "")
+        text = text.replace("-", "")
+        text = text.replace(";", "")
+        text = text.replace("…", "")
+        text = text.replace("&", "and")
+        text = text.strip()
+        return text
+
+
+CONSTANTS = [
+    "University of Michigan, Bentley Historical Library",
+    "The MediaPreserve",
+    "US, MiU-H",
+    "ANALOGUE",
+    "PCM",
+    "96000",
+    "24",
+]
+
+
+def make_corpus(number, seed=0):
+    random_state = random.Random(seed)
+    words = ["Paul", "Phillips", "Tape", "No.", "4", "“Interview”", "Ann Arbor's", "1969-1970", "A&M", "Studer A-810;", "open reel…", "\n", "\t", "  "]
+    corpus = []
+    for n in range(number):
+        if n % 2:
+            corpus.append(random_state.choice(CONSTANTS))
+        else:
+            corpus.append(" ".join(random_state.choice(words) for _ in range(random_state.randint(1, 12))))
+    return corpus
+
+
+def time_sanitize(function, corpus):
+    start = time.perf_counter()
+    for text in corpus:
+        function(text)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", type=int, default=100000, help="Number of strings to sanitize")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.number)
+    mismatches = [text for text in corpus if sanitize_text(text) != replace_sanitize_text(text)]
+    sanitize_text.cache_clear()
+
+    replace_seconds = time_sanitize(replace_sanitize_text, corpus)
+    cached_seconds = time_sanitize(sanitize_text, corpus)
+    uncached_seconds = time_sanitize(sanitize_text.__wrapped__, corpus)
+
+    print("{} strings, {} mismatches".format(args.number, len(mismatches)))
+    print("re.sub and str.replace:     {:6.2f} us/string".format(replace_seconds / args.number * 1e6))
+    print("precompiled, uncached:      {:6.2f} us/string".format(uncached_seconds / args.number * 1e6))
+    print("precompiled, cached:        {:6.2f} us/string".format(cached_seconds / args.number * 1e6))
+    print("speedup:                    {:6.2f}x".format(replace_seconds / cached_seconds))
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
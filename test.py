@@ -1,9 +1,52 @@
+import datetime
 import os
 import shutil
+import sqlite3
+import struct
+import subprocess
+import sys
 import tempfile
 import unittest
+from unittest import mock
 
-from baroque.baroque_project import BaroqueProject
+from baroque.baroque_project import BaroqueProject, ItemMetadata
+from baroque.bext_chunk_reader import read_bext_chunk, WavChunkError
+from baroque.checksum_cache import ChecksumCache
+from baroque.checksum_validation import ChecksumValidator
+from baroque.mets_validation import clark, is_streamed_element_kept, validate_item_mets
+from baroque.pipeline import ValidationPipeline
+from baroque.report_generation import ArrowErrorSink, ParquetErrorSink, SummaryErrorSink
+from baroque.utils import normalize_date
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def write_wav(path, description="", coding_history="", rf64=False):
+    """
+    Writes a small 96 kHz/24-bit mono WAV file with a bext chunk and a LIST/INFO chunk after the audio data"""
+    fmt = struct.pack("<HHIIHH", 1, 1, 96000, 288000, 3, 24)
+    bext = struct.pack(
+        "<256s32s32s10s8sIIH64s5h180s",
+        description.encode(), b"US, MiU-H", b"MiU-H_" + os.path.splitext(os.path.basename(path))[0].encode(),
+        b"2019-05-20", b"12:04:58", 276384000, 0, 1, b"", 0, 0, 0, 0, 0, b""
+    ) + coding_history.encode()
+    info = b"INFO" + b"IENG" + struct.pack("<I", 17) + b"Schreibeis, Ryan\x00" + b"\x00"
+    data = b"\x00" * 3 * 96
+
+    chunks = b""
+    if rf64:
+        chunks += b"ds64" + struct.pack("<IQQQI", 28, 0, len(data), 96, 0)
+    chunks += b"fmt " + struct.pack("<I", len(fmt)) + fmt
+    chunks += b"bext" + struct.pack("<I", len(bext)) + bext + b"\x00" * (len(bext) & 1)
+    chunks += b"data" + struct.pack("<I", 0xFFFFFFFF if rf64 else len(data)) + data
+    chunks += b"LIST" + struct.pack("<I", len(info)) + info
+
+    with open(path, "wb") as f:
+        f.write(b"RF64" + struct.pack("<I", 0xFFFFFFFF) if rf64 else b"RIFF" + struct.pack("<I", len(chunks) + 4))
+        f.write(b"WAVE" + chunks)
 
 
 class TestBaroque(unittest.TestCase):
@@ -19,6 +62,378 @@ class TestBaroque(unittest.TestCase):
         self.assertEqual(project.destination_directory, dst_dir_tmp)
         shutil.rmtree(tmp_dir)
 
+    def test_read_bext_chunk(self):
+        tmp_dir = tempfile.mkdtemp()
+        coding_history = "A=ANALOGUE,M=mono,T=Studer A-810; 7.5 ips; open reel\r\nA=PCM,F=96000,W=24,M=mono,T=Antelope Audio;Orion 32;A/D\r\n"
+        for rf64 in [False, True]:
+            path_to_wav = os.path.join(tmp_dir, "0648-SR-4-1-am.wav")
+            write_wav(path_to_wav, "Paul Phillips (Tape No. 4)", coding_history, rf64=rf64)
+            row = read_bext_chunk(path_to_wav)
+            self.assertEqual(row["Description"], "Paul Phillips (Tape No. 4)")
+            self.assertEqual(row["Originator"], "US, MiU-H")
+            self.assertEqual(row["OriginatorReference"], "MiU-H_0648-SR-4-1-am")
+            self.assertEqual(row["OriginationDate"], "2019-05-20")
+            self.assertEqual(row["OriginationTime"], "12:04:58")
+            self.assertEqual(row["TimeReference"], "276384000")
+            self.assertEqual(row["TimeReference (translated)"], "00:47:59.000")
+            self.assertEqual(row["CodingHistory"], coding_history)
+            self.assertEqual(row["IENG"], "Schreibeis, Ryan")
+            self.assertEqual(row["UMID"], "")
+
+        not_a_wav = os.path.join(tmp_dir, "0648-SR-4-1.mp3")
+        with open(not_a_wav, "wb") as f:
+            f.write(b"ID3")
+        with self.assertRaises(WavChunkError):
+            read_bext_chunk(not_a_wav)
+        shutil.rmtree(tmp_dir)
+
+    def test_validate_checksums(self):
+        tmp_dir = tempfile.mkdtemp()
+        item_dir_tmp = os.path.join(tmp_dir, "0648-SR-4")
+        dst_dir_tmp = os.path.join(tmp_dir, "destination")
+        os.makedirs(item_dir_tmp)
+        os.makedirs(dst_dir_tmp)
+        files = {
+            "0648-SR-4-1-am.wav": "d41d8cd98f00b204e9800998ecf8427e *0648-SR-4-1-am.wav",
+            "0648-SR-4-1-pm.wav": "ffffffffffffffffffffffffffffffff",
+            "0648-SR-4-1.mp3": "not a checksum",
+            "0648-SR-4-2.mp3": None,
+        }
+        for file, checksum in files.items():
+            open(os.path.join(item_dir_tmp, file), "wb").close()
+            if checksum is not None:
+                with open(os.path.join(item_dir_tmp, file + ".md5"), "w") as f:
+                    f.write(checksum + "\n")
+        with open(os.path.join(item_dir_tmp, "0648-SR-4-3.mp3.md5"), "w") as f:
+            f.write("d41d8cd98f00b204e9800998ecf8427e")
+        with open(os.path.join(item_dir_tmp, "0648-SR-4-1.mp3"), "wb") as f:
+            f.write(b"not verified")
+
+        project = BaroqueProject(item_dir_tmp, dst_dir_tmp)
+        ChecksumValidator(project).validate()
+        errors = sorted((os.path.basename(error.path), error.error) for error in project.errors["checksum"])
+        self.assertEqual(errors, [
+            ("0648-SR-4-1-pm.wav", "checksum d41d8cd98f00b204e9800998ecf8427e does not match ffffffffffffffffffffffffffffffff in md5 sidecar"),
+            ("0648-SR-4-1.mp3.md5", "md5 sidecar is malformed"),
+            ("0648-SR-4-2.mp3", "file has no md5 sidecar"),
+            ("0648-SR-4-3.mp3.md5", "md5 sidecar has no corresponding file: '0648-SR-4-3.mp3'"),
+        ])
+
+        # Verifying the item in a pipelined run finds the same errors,
+        # and only counts the files whose sidecar could be read, whether or not the cache is used
+        pipelined_project = BaroqueProject(item_dir_tmp, dst_dir_tmp)
+        validator = ChecksumValidator(pipelined_project, use_cache=False)
+        ValidationPipeline([validator]).validate()
+        pipelined_errors = sorted((os.path.basename(error.path), error.error) for error in pipelined_project.errors["checksum"])
+        self.assertEqual(pipelined_errors, errors)
+        self.assertEqual((validator.verified_files, validator.cached_files, validator.bytes_to_hash), (2, 0, 0))
+        shutil.rmtree(tmp_dir)
+
+    def test_checksum_cache(self):
+        tmp_dir = tempfile.mkdtemp()
+        path = os.path.join(tmp_dir, "0648-SR-4-1.mp3")
+        with open(path, "wb") as f:
+            f.write(b"ID3")
+
+        def file_record():
+            stat = os.stat(path)
+            return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+        cache = ChecksumCache(tmp_dir)
+        cache.set(path, file_record(), "d41d8cd98f00b204e9800998ecf8427e")
+        cache.close()
+
+        cache = ChecksumCache(tmp_dir)
+        self.assertEqual(cache.get(path, file_record()), "d41d8cd98f00b204e9800998ecf8427e")
+        with open(path, "ab") as f:
+            f.write(b"\x00")
+        self.assertIsNone(cache.get(path, file_record()))
+        cache.close()
+        shutil.rmtree(tmp_dir)
+
+    def test_run_manifest(self):
+        tmp_dir = tempfile.mkdtemp()
+        item_dir_tmp = os.path.join(tmp_dir, "0648-SR-4")
+        dst_dir_tmp = os.path.join(tmp_dir, "destination")
+        os.makedirs(item_dir_tmp)
+        os.makedirs(dst_dir_tmp)
+        for file in ["0648-SR-4-1.mp3", "0648-SR-4-2.mp3"]:
+            open(os.path.join(item_dir_tmp, file), "wb").close()
+
+        cached_errors = None
+
+        def validate(**project_options):
+            project = BaroqueProject(item_dir_tmp, dst_dir_tmp, **project_options)
+            validator = ChecksumValidator(project, use_cache=False)
+            items = validator.get_items_to_validate()
+            validator.add_item_results(items, [validator.item_validator(validator.get_item_task(item)) for item, cached in items if not cached])
+            validator.finish()
+            # The manifest is closed once it is saved
+            nonlocal cached_errors
+            cached_errors = None
+            if project.manifest:
+                cached_errors = project.manifest.get_cached_errors("checksum", project.items[0])
+                project.manifest.save()
+                self.assertRaises(sqlite3.ProgrammingError, project.manifest.connection.execute, "SELECT 1")
+            return project, [item for item, cached in items if not cached]
+
+        # Without incremental, no manifest is kept
+        project, items = validate()
+        self.assertIsNone(project.manifest)
+        self.assertEqual(len(items), 1)
+        self.assertFalse(os.path.exists(os.path.join(dst_dir_tmp, "baroque-manifest.sqlite3")))
+
+        project, items = validate(incremental=True)
+        self.assertEqual(len(items), 1)
+        errors = list(project.errors["checksum"])
+        self.assertEqual(len(errors), 2)
+
+        # An unchanged item is skipped, and the errors cached for it are replayed in the order they were found
+        project, items = validate(incremental=True)
+        self.assertEqual(items, [])
+        self.assertEqual(cached_errors, [error[1:] for error in errors])
+        self.assertEqual(project.errors["checksum"], errors)
+
+        # Without the cache, the item is validated again
+        project, items = validate(incremental=True, use_cache=False)
+        self.assertEqual(len(items), 1)
+        self.assertIsNone(cached_errors)
+        self.assertEqual(project.errors["checksum"], errors)
+
+        # A changed item is validated again, replacing the errors cached for it
+        with open(os.path.join(item_dir_tmp, "0648-SR-4-2.mp3.md5"), "w") as f:
+            f.write("d41d8cd98f00b204e9800998ecf8427e")
+        project, items = validate(incremental=True)
+        self.assertEqual(len(items), 1)
+        self.assertEqual(len(project.errors["checksum"]), 1)
+        project, items = validate(incremental=True)
+        self.assertEqual(items, [])
+        self.assertEqual(len(project.errors["checksum"]), 1)
+
+        # A read-only manifest replays cached errors, but does not record the errors of items it validates again
+        os.remove(os.path.join(item_dir_tmp, "0648-SR-4-2.mp3.md5"))
+        project, items = validate(incremental=True, read_only_manifest=True)
+        self.assertEqual(len(items), 1)
+        self.assertEqual(len(project.errors["checksum"]), 2)
+        project, items = validate(incremental=True, use_cache=True)
+        self.assertEqual(len(items), 1)
+        shutil.rmtree(tmp_dir)
+
+    def test_incremental_error_order(self):
+        tmp_dir = tempfile.mkdtemp()
+        collection_dir_tmp = os.path.join(tmp_dir, "0648")
+        dst_dir_tmp = os.path.join(tmp_dir, "destination")
+        os.makedirs(dst_dir_tmp)
+        for item in ["0648-SR-1", "0648-SR-2", "0648-SR-3"]:
+            os.makedirs(os.path.join(collection_dir_tmp, item))
+            open(os.path.join(collection_dir_tmp, item, "{}-1.mp3".format(item)), "wb").close()
+
+        def validate(pipelined=False, **project_options):
+            project = BaroqueProject(collection_dir_tmp, dst_dir_tmp, **project_options)
+            if pipelined:
+                ValidationPipeline([ChecksumValidator(project)]).validate()
+            else:
+                ChecksumValidator(project).validate_checksums()
+            if project.manifest:
+                project.manifest.save()
+            return list(project.errors["checksum"])
+
+        validate(incremental=True)
+        # Errors of a changed item in the middle of the project stay in their place among the cached errors of the other items
+        open(os.path.join(collection_dir_tmp, "0648-SR-2", "0648-SR-2-2.mp3"), "wb").close()
+        expected_errors = validate()
+        self.assertEqual(len(expected_errors), 4)
+        self.assertEqual(validate(incremental=True), expected_errors)
+        open(os.path.join(collection_dir_tmp, "0648-SR-2", "0648-SR-2-3.mp3"), "wb").close()
+        expected_errors = validate()
+        self.assertEqual(validate(pipelined=True, incremental=True), expected_errors)
+        shutil.rmtree(tmp_dir)
+
+    def test_metadata_export_snapshot(self):
+        tmp_dir = tempfile.mkdtemp()
+        item_dir_tmp = os.path.join(tmp_dir, "0648-SR-4")
+        dst_dir_tmp = os.path.join(tmp_dir, "destination")
+        os.makedirs(item_dir_tmp)
+        os.makedirs(dst_dir_tmp)
+        open(os.path.join(item_dir_tmp, "0648-SR-4-1-am.wav"), "wb").close()
+        export = os.path.join(tmp_dir, "export.csv")
+
+        def write_export(item_title):
+            with open(export, "w", newline="") as f:
+                f.write("DigFile Calc,COLLECTIONS::CollectionTitle,ItemTitle,ItemDate\n0648-SR-4,Paul Phillips papers,{},2019-05-20\n".format(item_title))
+
+        parse_metadata_export = BaroqueProject.parse_metadata_export
+        with mock.patch.object(BaroqueProject, "parse_metadata_export", autospec=True, side_effect=parse_metadata_export) as parse:
+            write_export("Tape No. 4")
+            project = BaroqueProject(item_dir_tmp, dst_dir_tmp, export)
+            self.assertEqual(parse.call_count, 1)
+            self.assertTrue(os.path.exists(os.path.join(dst_dir_tmp, "baroque-export-snapshot.pickle")))
+
+            # An unchanged export is loaded from the snapshot
+            self.assertEqual(BaroqueProject(item_dir_tmp, dst_dir_tmp, export).metadata, project.metadata)
+            self.assertEqual(parse.call_count, 1)
+
+            # Without the cache, the export is parsed again
+            BaroqueProject(item_dir_tmp, dst_dir_tmp, export, use_cache=False)
+            self.assertEqual(parse.call_count, 2)
+
+            # A changed export is parsed again and its snapshot rewritten
+            write_export("Tape No. 5")
+            project = BaroqueProject(item_dir_tmp, dst_dir_tmp, export)
+            self.assertEqual(parse.call_count, 3)
+            self.assertEqual(project.metadata["item_metadata"]["0648-SR-4"].item_title, "Tape No. 5")
+            BaroqueProject(item_dir_tmp, dst_dir_tmp, export)
+            self.assertEqual(parse.call_count, 3)
+        shutil.rmtree(tmp_dir)
+
+    def test_parse_xlsx_metadata_export(self):
+        import openpyxl
+        tmp_dir = tempfile.mkdtemp()
+        item_dir_tmp = os.path.join(tmp_dir, "0648-SR-4")
+        dst_dir_tmp = os.path.join(tmp_dir, "destination")
+        os.makedirs(item_dir_tmp)
+        os.makedirs(dst_dir_tmp)
+        open(os.path.join(item_dir_tmp, "0648-SR-4-1-am.wav"), "wb").close()
+        export = os.path.join(tmp_dir, "export.xlsx")
+        workbook = openpyxl.Workbook()
+        sheet = workbook.active
+        sheet.append(["ItemDate", "DigFile Calc", "ItemTitle", "COLLECTIONS::CollectionTitle"])
+        sheet.append(["2019-05-20", "0648-SR-4", "Tape No. 4", "Paul Phillips papers"])
+        sheet.append([None, None, "row without an item id", None])
+        sheet.append([None, "0700-SR-1"])
+        workbook.save(export)
+
+        with mock.patch.object(openpyxl, "load_workbook", side_effect=openpyxl.load_workbook) as load_workbook:
+            project = BaroqueProject(item_dir_tmp, dst_dir_tmp, export, use_cache=False)
+        # The workbook is streamed row by row rather than loaded whole
+        self.assertTrue(load_workbook.call_args.kwargs["read_only"])
+        self.assertEqual(project.metadata, {
+            "collections_ids": {"0648": ["0648-SR-4"], "0700": ["0700-SR-1"]},
+            "item_metadata": {
+                "0648-SR-4": ItemMetadata("Paul Phillips papers", "Tape No. 4", "2019-05-20"),
+                "0700-SR-1": ItemMetadata(None, None, None)
+            }
+        })
+        shutil.rmtree(tmp_dir)
+
+    def test_intellectual_groups(self):
+        tmp_dir = tempfile.mkdtemp()
+        item_dir_tmp = os.path.join(tmp_dir, "0648-SR-4")
+        dst_dir_tmp = os.path.join(tmp_dir, "destination")
+        os.makedirs(item_dir_tmp)
+        os.makedirs(dst_dir_tmp)
+        files = [
+            "0648-SR-4-1-am.wav", "0648-SR-4-1-am.wav.md5", "0648-SR-4-1-pm.wav", "0648-SR-4-1-pm.wav.md5",
+            "0648-SR-4-1.mp3", "0648-SR-4-1.mp3.md5", "0648-SR-4-2-am.wav", "0648-SR-4-2-am.wav.copy.wav", "0648-SR-4.xml"
+        ]
+        for file in files:
+            open(os.path.join(item_dir_tmp, file), "wb").close()
+
+        project = BaroqueProject(item_dir_tmp, dst_dir_tmp)
+        groups = project.get_intellectual_groups()
+        self.assertIs(groups, project.get_intellectual_groups())
+        self.assertEqual(groups["0648-SR-4"]["0648-SR-4-1"].counts, [1, 1, 1, 1, 1, 1])
+        self.assertEqual(groups["0648-SR-4"]["0648-SR-4-2"].counts, [1, 0, 0, 0, 0, 0])
+        self.assertEqual(groups["0648-SR-4"]["0648-SR-4-2"].other, ["0648-SR-4-2-am.wav.copy.wav"])
+        shutil.rmtree(tmp_dir)
+
+    def test_normalize_date(self):
+        import dateparser
+        normalize_date.cache_clear()
+        for text in ["2019-05-20", "12:04:58", "May 20, 2019", "20 mai 2019", "2019-02-29", "not a date"]:
+            self.assertEqual(normalize_date(text), dateparser.parse(text), text)
+        self.assertEqual(normalize_date("2019-05-20"), datetime.datetime(2019, 5, 20))
+        self.assertEqual(normalize_date("May 20, 2019"), datetime.datetime(2019, 5, 20))
+        self.assertIsNone(normalize_date("not a date"))
+
+        # Repeated dates are served from the cache
+        hits = normalize_date.cache_info().hits
+        self.assertIs(normalize_date("May 20, 2019"), normalize_date("May 20, 2019"))
+        self.assertEqual(normalize_date.cache_info().hits, hits + 2)
+
+    def test_stream_mets(self):
+        tmp_dir = tempfile.mkdtemp()
+        with open(os.path.join(tmp_dir, "0648-SR-4.xml"), "w") as f:
+            f.write(
+                '<mets:mets xmlns:mets="http://www.loc.gov/METS/" xmlns:aes="http://www.aes.org/audioObject" xmlns:ph="http://www.aes.org/processhistory" OBJID="0648-SR-4">'
+                '<mets:amdSec>'
+                '<mets:techMD><mets:mdWrap><mets:xmlData><aes:audioObject><aes:format>WAVE</aes:format>'
+                '<aes:primaryIdentifier>0648-SR-4-1-am.wav</aes:primaryIdentifier></aes:audioObject></mets:xmlData></mets:mdWrap></mets:techMD>'
+                '<mets:techMD><mets:mdWrap><mets:xmlData/></mets:mdWrap></mets:techMD>'
+                '<mets:digiprovMD><mets:mdWrap><mets:xmlData>' + '<ph:processHistory><ph:step>1</ph:step></ph:processHistory>' * 100 +
+                '</mets:xmlData></mets:mdWrap></mets:digiprovMD>'
+                '</mets:amdSec>'
+                '<mets:behaviorSec/><mets:behaviorSec><mets:mechanism LOCTYPE="URL"/></mets:behaviorSec>'
+                '</mets:mets>'
+            )
+        item = {"id": "0648-SR-4", "path": tmp_dir, "files": {"xml": ["0648-SR-4.xml"], "wav": ["0648-SR-4-1-am.wav", "0648-SR-4-1-pm.wav"], "mp3": [], "txt": []}}
+
+        errors = validate_item_mets((item, None, False))
+        self.assertIn(("requirement", os.path.join(tmp_dir, "0648-SR-4.xml"), "0648-SR-4", "subelement mets:sourceMD not found in {http://www.loc.gov/METS/}amdSec"), errors)
+        self.assertEqual(validate_item_mets((item, None, True)), errors)
+        # Elements in discarded sections are discarded on their own, rather than with their section
+        self.assertFalse(is_streamed_element_kept(clark("mets:mets/mets:behaviorSec/mets:mechanism")))
+        self.assertTrue(is_streamed_element_kept(clark("mets:mets/mets:fileSec/mets:fileGrp")))
+        self.assertFalse(is_streamed_element_kept(clark("mets:mets/mets:amdSec/mets:techMD/mets:mdWrap/mets:xmlData/aes:audioObject/aes:format")))
+        shutil.rmtree(tmp_dir)
+
+    def test_error_counts(self):
+        tmp_dir = tempfile.mkdtemp()
+        sink = SummaryErrorSink(tmp_dir, tmp_dir)
+        sink.register("structure")
+        sink.add("mets", "requirement", "0648-SR-4.xml", "0648-SR-4", "mets xml is not valid")
+        sink.add("mets", "warning", "0648-SR-4.xml", "0648-SR-4", "item date not found in metadata export spreadsheet to validate against mets xml")
+        sink.add("mets", "requirement", "0648-SR-5.xml", "0648-SR-5", "mets xml is not valid")
+        self.assertEqual(sink.counts, {"structure": {"requirement": 0, "warning": 0}, "mets": {"requirement": 2, "warning": 1}})
+        self.assertEqual(sink.item_counts["mets"]["0648-SR-4"], {"requirement": 1, "warning": 1})
+        self.assertIsNone(sink.close())
+        self.assertEqual(os.listdir(tmp_dir), [])
+
+        # Errors reported against a file name or a part id are counted against the item they belong to
+        item_dir_tmp = os.path.join(tmp_dir, "0648", "0648-SR-4")
+        os.makedirs(os.path.join(item_dir_tmp, "images"))
+        open(os.path.join(item_dir_tmp, "0648-SR-4-1-am.wav"), "wb").close()
+        project = BaroqueProject(os.path.join(tmp_dir, "0648"), tmp_dir, error_sink=SummaryErrorSink)
+        project.add_errors("structure", "requirement", os.path.join(item_dir_tmp, "0648-SR-4-1"), "0648-SR-4-1", "digital part has 1 total files")
+        project.add_errors("structure", "requirement", os.path.join(item_dir_tmp, "images", "0648-SR-4.jpg"), "0648-SR-4.jpg", "empty file")
+        project.add_errors("structure", "requirement", os.path.join(tmp_dir, "export.csv"), "0648-SR-5", "item id does not exist in directory")
+        self.assertEqual(project.error_sink.item_counts["structure"], {"0648-SR-4": {"requirement": 2, "warning": 0}, "0648-SR-5": {"requirement": 1, "warning": 0}})
+        self.assertIsNone(project.get_item_id(os.path.join(tmp_dir, "export.csv"), "0648-SR-5"))
+        shutil.rmtree(tmp_dir)
+
+    @unittest.skipUnless(pyarrow, "pyarrow is not installed")
+    def test_columnar_reports(self):
+        import pyarrow.ipc
+        import pyarrow.parquet
+        errors = [
+            ("mets", "requirement", "0648-SR-4.xml", "0648-SR-4", "mets xml is not valid"),
+            ("mets", "warning", "0648-SR-4.xml", "0648-SR-4", "item date not found in metadata export spreadsheet to validate against mets xml"),
+            ("checksum", "requirement", "0648-SR-5-1.mp3", "0648-SR-5", "file has no md5 sidecar"),
+            ("checksum", "requirement", "0648-SR-5-2.mp3", "0648-SR-5", "file has no md5 sidecar"),
+            ("checksum", "requirement", "0648-SR-6-1.mp3", "0648-SR-6", "file has no md5 sidecar"),
+        ]
+        for error_sink, read_table in [(ParquetErrorSink, pyarrow.parquet.read_table), (ArrowErrorSink, lambda path: pyarrow.ipc.open_file(path).read_all())]:
+            tmp_dir = tempfile.mkdtemp()
+            sink = error_sink(tmp_dir, tmp_dir)
+            # Write the errors in several batches, with new dictionary values in later batches
+            sink.batch_size = 2
+            for error in errors:
+                sink.add(*error)
+            table = read_table(sink.close())
+            self.assertEqual(list(zip(*[table.column(field).to_pylist() for field in table.column_names])), errors)
+            self.assertEqual(str(table.schema.field("path").type), "dictionary<values=string, indices=int32, ordered=0>")
+            shutil.rmtree(tmp_dir)
+
+    def test_lazy_imports(self):
+        baroque_dir = os.path.dirname(os.path.abspath(__file__))
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", os.path.join(baroque_dir, "baroque.py"), "--help"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        imported = set(line.split("|")[-1].strip() for line in result.stderr.splitlines())
+        for module in ["dateparser", "lxml", "openpyxl", "baroque.baroque_project"]:
+            self.assertNotIn(module, imported)
+
 
 if __name__ == "__main__":
     unittest.main()